@@ -0,0 +1,33 @@
+"""birthday month day index
+
+Revision ID: 062ac638cccd
+Revises: 835de8f2f2c1
+Create Date: 2026-10-18 13:48:53.619563
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '062ac638cccd'
+down_revision: Union[str, Sequence[str], None] = '835de8f2f2c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_users_birth_month_day',
+        'users',
+        [sa.text('EXTRACT(month FROM birthday)'), sa.text('EXTRACT(day FROM birthday)')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_birth_month_day', table_name='users')
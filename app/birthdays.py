@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import CachedUser, user_crud
+
+
+@dataclass(frozen=True)
+class BirthdayEntry:
+  user: CachedUser
+  # Сколько исполняется в ближайший (или сегодняшний) день рождения
+  turning: int
+
+
+def turning_age(birthday: date, today: date) -> int:
+  age = today.year - birthday.year
+
+  # День рождения в этом году уже прошёл — ближайший будет в следующем
+  if (today.month, today.day) > (birthday.month, birthday.day):
+    age += 1
+
+  return age
+
+
+class BirthdaySummary:
+  """Отсортированные списки именинников месяца с возрастами, общие для подписи календаря и рассылки"""
+
+  def __init__(self, max_entries: int = 24):
+    self.max_entries = max_entries
+    self._entries: OrderedDict[tuple[str | None, int, int, date], list[BirthdayEntry]] = OrderedDict()
+
+  async def month_entries(
+    self,
+    session: AsyncSession,
+    month: int,
+    today: date | None = None,
+    group_id: str | None = None
+  ) -> list[BirthdayEntry]:
+    today = today or date.today()
+    key = (group_id, month, user_crud.roster_version(month), today)
+
+    entries = self._entries.get(key)
+    if entries is not None:
+      self._entries.move_to_end(key)
+      return entries
+
+    users = await user_crud.get_users_born_in_month(session, month, group_id)
+    entries = [
+      BirthdayEntry(user=user, turning=turning_age(user.birthday, today))
+      for user in sorted(users, key=lambda user: user.birthday.day)
+    ]
+
+    self._entries[key] = entries
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+    return entries
+
+  @staticmethod
+  def calendar_caption(entries: list[BirthdayEntry]) -> str:
+    return ''.join(
+      f'{entry.user.birthday.day}.{entry.user.birthday.month}.{entry.user.birthday.year}: '
+      f'{entry.user.name} - @{entry.user.username} (исполняется {entry.turning})\n'
+      for entry in entries
+    )
+
+  @staticmethod
+  def notification_text(entries: list[BirthdayEntry]) -> str:
+    message_parts = ["🎉 Сегодня день рождения отмечают:\n"]
+    message_parts.extend(
+      f'{entry.user.birthday.day}.{entry.user.birthday.month}.{entry.user.birthday.year}: '
+      f'{entry.user.name} - @{entry.user.username} исполняется {entry.turning} ✨'
+      for entry in entries
+    )
+    return "\n".join(message_parts)
+
+birthday_summary = BirthdaySummary()
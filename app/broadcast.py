@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from collections.abc import AsyncIterable, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+  TelegramBadRequest,
+  TelegramForbiddenError,
+  TelegramNetworkError,
+  TelegramNotFound,
+  TelegramRetryAfter,
+  TelegramServerError,
+)
+
+from config import settings
+from app.metrics import (
+  broadcast_duration_seconds,
+  broadcast_messages,
+  broadcast_retry_after,
+  broadcast_retry_after_seconds,
+  broadcast_send_seconds,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+  """Ограничитель частоты: не больше rate операций в секунду с запасом capacity"""
+
+  def __init__(self, rate: float, capacity: float | None = None):
+    self.rate = rate
+    self.capacity = capacity or rate
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._paused_until = 0.0
+    self._lock = asyncio.Lock()
+
+  def pause(self, seconds: float):
+    """Остановить выдачу токенов, например после 429 от Telegram"""
+    self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    # Токены начинают копиться только после паузы, а не за её время
+    self._tokens = 0
+    self._updated = self._paused_until
+
+  async def acquire(self):
+    async with self._lock:
+      while True:
+        now = time.monotonic()
+
+        if now < self._paused_until:
+          await asyncio.sleep(self._paused_until - now)
+          continue
+
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+
+        await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastResult:
+  sent: int = 0
+  failed: int = 0
+  blocked: list[str] = field(default_factory=list)
+
+
+class Broadcaster:
+  """Рассылка одного сообщения множеству чатов с учётом лимитов Telegram"""
+
+  def __init__(
+    self,
+    rate: float = 25,
+    per_chat_interval: float = 1.0,
+    workers: int = 16,
+    max_retries: int = 3
+  ):
+    self.bucket = TokenBucket(rate)
+    self.per_chat_interval = per_chat_interval
+    self.workers = workers
+    self.max_retries = max_retries
+
+    self._last_sent: dict[str, float] = {}
+
+  async def _wait_for_chat(self, chat_id: str):
+    last = self._last_sent.get(chat_id)
+    if last is not None:
+      delay = last + self.per_chat_interval - time.monotonic()
+      if delay > 0:
+        await asyncio.sleep(delay)
+
+  async def _send_one(self, bot: Bot, chat_id: str, text: str, result: BroadcastResult):
+    for attempt in range(self.max_retries + 1):
+      await self._wait_for_chat(chat_id)
+      await self.bucket.acquire()
+
+      try:
+        with broadcast_send_seconds.time():
+          await bot.send_message(chat_id=chat_id, text=text)
+        self._last_sent[chat_id] = time.monotonic()
+        result.sent += 1
+        broadcast_messages.labels(result='sent').inc()
+        return
+      except TelegramRetryAfter as e:
+        # Флуд-контроль общий для бота, поэтому тормозим всех воркеров
+        logger.warning('Flood control, пауза %s с', e.retry_after)
+        broadcast_retry_after.inc()
+        broadcast_retry_after_seconds.inc(e.retry_after)
+        self.bucket.pause(e.retry_after)
+      except (TelegramForbiddenError, TelegramNotFound):
+        # Бот заблокирован, пользователь удалён или чат не существует
+        result.blocked.append(chat_id)
+        broadcast_messages.labels(result='blocked').inc()
+        return
+      except TelegramBadRequest as e:
+        if 'chat not found' in e.message.lower() or 'deactivated' in e.message.lower():
+          result.blocked.append(chat_id)
+          broadcast_messages.labels(result='blocked').inc()
+        else:
+          logger.warning('Не удалось отправить сообщение пользователю %s: %s', chat_id, e)
+          result.failed += 1
+          broadcast_messages.labels(result='failed').inc()
+        return
+      except (TelegramNetworkError, TelegramServerError) as e:
+        logger.warning('Ошибка отправки пользователю %s (попытка %s): %s', chat_id, attempt + 1, e)
+        await asyncio.sleep(2 ** attempt)
+
+    result.failed += 1
+    broadcast_messages.labels(result='failed').inc()
+
+  async def _worker(self, bot: Bot, queue: asyncio.Queue, result: BroadcastResult):
+    while True:
+      chat_id, text = await queue.get()
+      try:
+        await self._send_one(bot, chat_id, text, result)
+      except Exception as e:
+        logger.exception('Не удалось отправить сообщение пользователю %s: %s', chat_id, e)
+        result.failed += 1
+        broadcast_messages.labels(result='failed').inc()
+      finally:
+        queue.task_done()
+
+  async def send(
+    self,
+    bot: Bot,
+    chat_ids: Iterable[str] | AsyncIterable[list[str]],
+    text: str
+  ) -> BroadcastResult:
+    """Разослать text; chat_ids — список id или асинхронный поток их порций"""
+    if isinstance(chat_ids, AsyncIterable):
+      async def messages():
+        async for chunk in chat_ids:
+          yield [(chat_id, text) for chat_id in chunk]
+      return await self.send_messages(bot, messages())
+
+    return await self.send_messages(bot, ((chat_id, text) for chat_id in chat_ids))
+
+  async def send_messages(
+    self,
+    bot: Bot,
+    messages: Iterable[tuple[str, str]] | AsyncIterable[list[tuple[str, str]]]
+  ) -> BroadcastResult:
+    """Разослать каждому чату свой текст; messages — пары (chat_id, text) или поток их порций"""
+    result = BroadcastResult()
+
+    now = time.monotonic()
+    self._last_sent = {
+      chat_id: sent_at for chat_id, sent_at in self._last_sent.items()
+      if now - sent_at < self.per_chat_interval
+    }
+
+    queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue(maxsize=self.workers * 4)
+    started = time.perf_counter()
+
+    workers = [
+      asyncio.create_task(self._worker(bot, queue, result))
+      for _ in range(self.workers)
+    ]
+    try:
+      if isinstance(messages, AsyncIterable):
+        async for chunk in messages:
+          for chat_id, text in chunk:
+            await queue.put((str(chat_id), text))
+      else:
+        for chat_id, text in messages:
+          await queue.put((str(chat_id), text))
+      await queue.join()
+    finally:
+      for worker in workers:
+        worker.cancel()
+      await asyncio.gather(*workers, return_exceptions=True)
+      broadcast_duration_seconds.observe(time.perf_counter() - started)
+
+    logger.info(
+      'Рассылка завершена: отправлено %s, ошибок %s, заблокировали бота %s',
+      result.sent, result.failed, len(result.blocked)
+    )
+    return result
+
+broadcaster = Broadcaster(
+  rate=settings.BROADCAST_RATE,
+  workers=settings.BROADCAST_WORKERS,
+  max_retries=settings.BROADCAST_MAX_RETRIES
+)
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+
+
+@dataclass
+class CachedCalendar:
+  file_id: str
+  caption: str
+  rendered_on: date
+
+
+@dataclass
+class RenderedCalendar:
+  image: bytes
+  caption: str
+  rendered_on: date
+
+
+class CalendarCache:
+  """Кэш отрисованных календарей: (группа, год, месяц, версия состава) -> file_id в Telegram.
+
+  Группа None — общий календарь личных чатов, месяц 0 — обзор года. Заранее
+  отрисованные, но ещё не отправленные календари хранятся отдельно как байты.
+  """
+
+  def __init__(self, max_entries: int = 256, max_images: int = 32):
+    self.max_entries = max_entries
+    self.max_images = max_images
+    self._entries: OrderedDict[tuple[str | None, int, int, int], CachedCalendar] = OrderedDict()
+    self._images: OrderedDict[tuple[str | None, int, int, int], RenderedCalendar] = OrderedDict()
+
+  @staticmethod
+  def _get(storage: OrderedDict, key):
+    entry = storage.get(key)
+
+    if entry is None:
+      return None
+
+    # В подписи указан возраст, поэтому вчерашний рендер уже не годится
+    if entry.rendered_on != date.today():
+      del storage[key]
+      return None
+
+    storage.move_to_end(key)
+    return entry
+
+  @staticmethod
+  def _set(storage: OrderedDict, key, entry, max_entries: int):
+    storage[key] = entry
+    storage.move_to_end(key)
+
+    while len(storage) > max_entries:
+      storage.popitem(last=False)
+
+  def get(self, year: int, month: int, roster_version: int, group_id: str | None = None) -> CachedCalendar | None:
+    return self._get(self._entries, (group_id, year, month, roster_version))
+
+  def set(self, year: int, month: int, roster_version: int, file_id: str, caption: str, group_id: str | None = None):
+    key = (group_id, year, month, roster_version)
+    self._set(self._entries, key, CachedCalendar(file_id=file_id, caption=caption, rendered_on=date.today()), self.max_entries)
+    # После загрузки в Telegram байты больше не нужны
+    self._images.pop(key, None)
+
+  def get_image(self, year: int, month: int, roster_version: int, group_id: str | None = None) -> RenderedCalendar | None:
+    return self._get(self._images, (group_id, year, month, roster_version))
+
+  def set_image(self, year: int, month: int, roster_version: int, image: bytes, caption: str, group_id: str | None = None):
+    key = (group_id, year, month, roster_version)
+    self._set(self._images, key, RenderedCalendar(image=image, caption=caption, rendered_on=date.today()), self.max_images)
+
+  def contains(self, year: int, month: int, roster_version: int, group_id: str | None = None) -> bool:
+    key = (group_id, year, month, roster_version)
+    return key in self._entries or key in self._images
+
+calendar_cache = CalendarCache()
@@ -1,14 +1,165 @@
-from datetime import date
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
 
-from sqlalchemy import select
+from sqlalchemy import BigInteger, cast, delete, event, extract, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import User
+from app.metrics import crud_seconds, instrument
+from app.models import Group, Membership, User
+from config import settings
 from database import async_session_factory
 
+# Канал LISTEN/NOTIFY, по которому реплики сообщают друг другу об изменениях профилей
+ROSTER_CHANNEL = 'roster_changed'
+INSTANCE_ID = uuid.uuid4().hex
+
+@dataclass(frozen=True)
+class CachedUser:
+  """Неизменяемый снимок пользователя, безопасный для хранения между сессиями"""
+  tg_id: str
+  username: str | None
+  name: str | None
+  birthday: date | None
+  photo_id: str | None
+  timezone: str
+
+  @classmethod
+  def from_user(cls, user: User) -> 'CachedUser':
+    return cls(
+      tg_id=user.tg_id,
+      username=user.username,
+      name=user.name,
+      birthday=user.birthday,
+      photo_id=user.photo_id,
+      timezone=user.timezone
+    )
+
+class RosterCache:
+  """Кэш пользователей по tg_id и списков именинников по месяцам (общих или группы)"""
+
+  def __init__(self, ttl: float = 300):
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+
+    self._users: dict[str, tuple[float, CachedUser | None]] = {}
+    # (group_id, месяц); group_id=None — общий состав
+    self._months: dict[tuple[str | None, int], tuple[float, list[CachedUser]]] = {}
+
+  def _lookup(self, storage: dict, key):
+    entry = storage.get(key)
+    if entry is None or time.monotonic() - entry[0] > self.ttl:
+      storage.pop(key, None)
+      self.misses += 1
+      return False, None
+
+    self.hits += 1
+    return True, entry[1]
+
+  def get_user(self, tg_id: str) -> tuple[bool, CachedUser | None]:
+    return self._lookup(self._users, tg_id)
+
+  def set_user(self, tg_id: str, user: CachedUser | None):
+    self._users[tg_id] = (time.monotonic(), user)
+
+  def get_month(self, month: int, group_id: str | None = None) -> tuple[bool, list[CachedUser] | None]:
+    return self._lookup(self._months, (group_id, month))
+
+  def set_month(self, month: int, users: list[CachedUser], group_id: str | None = None):
+    self._months[(group_id, month)] = (time.monotonic(), users)
+
+  def invalidate(self, tg_id: str | None, months: set[int] = frozenset()):
+    if tg_id is not None:
+      self._users.pop(tg_id, None)
+    # Пользователь может состоять в любых группах, сбрасываем месяц во всех
+    for key in [key for key in self._months if key[1] in months]:
+      del self._months[key]
+
+  def invalidate_group(self, group_id: str):
+    for key in [key for key in self._months if key[0] == group_id]:
+      del self._months[key]
+
+  def clear(self):
+    self._users.clear()
+    self._months.clear()
+
+  def stats(self) -> dict[str, int]:
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'users': len(self._users),
+      'months': len(self._months)
+    }
+
+@instrument(crud_seconds, 'user.')
 class UserCRUD:
   def __init__(self):
-    pass
+    # Версии состава по месяцам (индекс — месяц, 0 не используется): меняются
+    # при изменении профилей родившихся в этом месяце (ДР, фото и подписи к ним),
+    # по ним инвалидируется кэш отрисованных календарей
+    self._month_versions = [0] * 13
+    self.cache = RosterCache(ttl=settings.ROSTER_CACHE_TTL)
+
+  def apply_invalidation(
+    self,
+    tg_id: str | None,
+    months: set[int] = frozenset(),
+    roster_changed: bool = False,
+    group_id: str | None = None
+  ):
+    """Сбросить кэш пользователя и его месяцев; tg_id=None без месяцев сбрасывает всё.
+
+    group_id — группа, состав которой изменился.
+    """
+    if tg_id is None and not months:
+      self.cache.clear()
+    else:
+      self.cache.invalidate(tg_id, months)
+
+    if group_id is not None:
+      self.cache.invalidate_group(group_id)
+
+    if roster_changed:
+      # Без месяцев неизвестно, чьи календари затронуты, — меняются все
+      for month in months or range(1, 13):
+        self._month_versions[month] += 1
+
+  def roster_version(self, month: int) -> int:
+    """Версия состава месяца; для 0 (обзор года) — всех месяцев вместе"""
+    if month == 0:
+      return sum(self._month_versions)
+    return self._month_versions[month]
+
+  async def _invalidate(
+    self,
+    session: AsyncSession,
+    tg_id: int | str | None,
+    months: set[int] = frozenset(),
+    roster_changed: bool = False,
+    group_id: str | None = None
+  ):
+    tg_id = str(tg_id) if tg_id is not None else None
+    invalidate = lambda *_: self.apply_invalidation(tg_id, months, roster_changed, group_id)
+
+    # Сбрасываем сразу и ещё раз после коммита: между ними кэши могли
+    # успеть заполниться старыми данными из параллельного запроса
+    invalidate()
+    event.listen(session.sync_session, 'after_commit', invalidate, once=True)
+
+    if settings.ROSTER_NOTIFY:
+      # Уйдёт другим репликам вместе с коммитом транзакции
+      payload = json.dumps({
+        'origin': INSTANCE_ID,
+        'tg_id': tg_id,
+        'months': sorted(months),
+        'roster_changed': roster_changed,
+        'group_id': group_id
+      })
+      await session.execute(select(func.pg_notify(ROSTER_CHANNEL, payload)))
 
   async def create_user(
     self,
@@ -16,16 +167,68 @@ class UserCRUD:
     tg_id: int,
     username: str
   ):
-    user = User(
-      tg_id=str(tg_id),
-      username=username
+    # Один запрос: новый пользователь создаётся, существующий
+    # только возвращается в рассылку, если раньше блокировал бота
+    query = (
+      insert(User)
+      .values(tg_id=str(tg_id), username=username)
+      .on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={'blocked_at': None},
+        where=User.blocked_at.is_not(None)
+      )
     )
-    session.add(user)
+    await session.execute(query)
+    await self._invalidate(session, tg_id)
+
+  async def bulk_upsert_users(
+    self,
+    session: AsyncSession,
+    users: list[dict],
+    chunk_size: int = 1000
+  ):
+    """Вставка или обновление пачки пользователей (импорт, миграции).
+
+    Все словари должны содержать одинаковый набор полей модели User, среди них tg_id.
+    """
+    if not users:
+      return
+
+    columns = [column for column in users[0] if column != 'tg_id']
+    for start in range(0, len(users), chunk_size):
+      chunk = [{**user, 'tg_id': str(user['tg_id'])} for user in users[start:start + chunk_size]]
+      query = insert(User).values(chunk)
+      query = query.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={
+          **{column: query.excluded[column] for column in columns},
+          'updated_at': func.timezone('utc', func.now())
+        }
+      )
+      await session.execute(query)
+
+    # Изменения затрагивают произвольных пользователей — сбрасываем кэш целиком
+    await self._invalidate(session, None, roster_changed=True)
     
   async def get_user(
     self,
     session: AsyncSession,
     tg_id: int,
+  ) -> CachedUser | None:
+    found, user = self.cache.get_user(str(tg_id))
+    if found:
+      return user
+
+    user = await self._load_user(session, tg_id)
+    user = CachedUser.from_user(user) if user else None
+    self.cache.set_user(str(tg_id), user)
+
+    return user
+
+  async def _load_user(
+    self,
+    session: AsyncSession,
+    tg_id: int,
   ) -> User | None:
     query = (
       select(User)
@@ -43,6 +246,164 @@ class UserCRUD:
     query = select(User)
     return (await session.execute(query)).scalars().all()
 
+  async def get_photo_ids(
+    self,
+    session: AsyncSession
+  ) -> set[str]:
+    query = select(User.photo_id).where(User.photo_id.is_not(None))
+    return set((await session.execute(query)).scalars().all())
+
+  async def get_users_born_in_month(
+    self,
+    session: AsyncSession,
+    month: int,
+    group_id: str | None = None
+  ) -> list[CachedUser]:
+    """Именинники месяца: все или только участники группы group_id"""
+    found, users = self.cache.get_month(month, group_id)
+    if found:
+      return users
+
+    query = (
+      select(User)
+      .where(extract('month', User.birthday) == month)
+      .order_by(extract('day', User.birthday))
+    )
+    if group_id is not None:
+      query = query.join(Membership, Membership.user_id == User.tg_id).where(Membership.group_id == group_id)
+
+    users = [CachedUser.from_user(user) for user in (await session.execute(query)).scalars()]
+    self.cache.set_month(month, users, group_id)
+
+    return users
+
+  async def get_chat_ids_to_notify(
+    self,
+    session: AsyncSession,
+    limit: int = 1000,
+    after_tg_id: str = '',
+    shards: int = 1,
+    shard: int = 0,
+    tz: str | None = None
+  ) -> list[str]:
+    """Порция tg_id получателей рассылки после after_tg_id, по возрастанию tg_id.
+
+    Постранично по ключу, а не курсором: рассылка идёт часами с ограничением
+    частоты, и каждую порцию можно взять в своей короткой сессии.
+
+    При shards > 1 отдаёт только получателей части shard (по остатку от tg_id),
+    при заданном tz — только пользователей этого часового пояса. Участники
+    групп получают поздравления в чате группы и сюда не попадают — если бота
+    из этой группы не удалили.
+    """
+    in_live_group = (
+      select(Membership.user_id)
+      .join(Group, Group.chat_id == Membership.group_id)
+      # Повтор границы страницы: иначе anti join перебирает участников с начала
+      .where(Membership.user_id == User.tg_id, Membership.user_id > after_tg_id, Group.blocked_at.is_(None))
+      .exists()
+    )
+    query = (
+      select(User.tg_id)
+      .where(
+        User.blocked_at.is_(None),
+        ~in_live_group,
+        User.tg_id > after_tg_id
+      )
+      .order_by(User.tg_id)
+      .limit(limit)
+    )
+    if tz is not None:
+      query = query.where(User.timezone == tz)
+    if shards > 1:
+      query = query.where(cast(User.tg_id, BigInteger) % shards == shard)
+    return list((await session.execute(query)).scalars())
+
+  async def get_notify_timezones(
+    self,
+    session: AsyncSession
+  ) -> list[str]:
+    """Часовые пояса, в которых есть получатели рассылки"""
+    query = select(User.timezone).where(User.blocked_at.is_(None)).distinct()
+    return list((await session.execute(query)).scalars())
+
+  async def set_timezone(
+    self,
+    session: AsyncSession,
+    tg_id: int,
+    tz: str
+  ):
+    query = (
+      update(User)
+      .where(User.tg_id == str(tg_id))
+      # Пояс не влияет на календарь и фото, updated_at не трогаем
+      .values(timezone=tz, updated_at=User.updated_at)
+      .execution_options(synchronize_session=False)
+    )
+    await session.execute(query)
+    await self._invalidate(session, tg_id)
+
+  async def mark_blocked(
+    self,
+    session: AsyncSession,
+    tg_ids: list[str]
+  ):
+    if not tg_ids:
+      return
+
+    query = (
+      update(User)
+      .where(User.tg_id.in_([str(tg_id) for tg_id in tg_ids]))
+      .values(blocked_at=datetime.now(timezone.utc).replace(tzinfo=None), updated_at=User.updated_at)
+    )
+    await session.execute(query)
+
+  async def get_stale_photos(
+    self,
+    session: AsyncSession,
+    limit: int,
+    after_tg_id: str = ''
+  ) -> list[tuple[str, str]]:
+    """Пользователи, чьё фото обновилось после последней загрузки (tg_id, photo_id)"""
+    query = (
+      select(User.tg_id, User.photo_id)
+      .where(
+        User.photo_id.is_not(None),
+        or_(User.installed_at.is_(None), User.installed_at < User.updated_at),
+        User.tg_id > after_tg_id
+      )
+      .order_by(User.tg_id)
+      .limit(limit)
+    )
+    return [tuple(row) for row in (await session.execute(query)).all()]
+
+  async def mark_photos_installed(
+    self,
+    session: AsyncSession,
+    photos: list[tuple[str, str]]
+  ):
+    if not photos:
+      return
+
+    # Сверяем и photo_id: если фото успели сменить, строка останется устаревшей
+    query = (
+      update(User)
+      .where(tuple_(User.tg_id, User.photo_id).in_(photos))
+      .values(
+        installed_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        # Служебная отметка не считается изменением профиля
+        updated_at=User.updated_at
+      )
+      .returning(User.birthday)
+      .execution_options(synchronize_session=False)
+    )
+    birthdays = (await session.execute(query)).scalars()
+
+    # Календари этих месяцев рисовались с заглушкой вместо фото
+    months = {birthday.month for birthday in birthdays if birthday}
+    if months:
+      await self._invalidate(session, None, months, roster_changed=True)
+
   async def change_user_data(
     self,
     session: AsyncSession,
@@ -53,30 +414,156 @@ class UserCRUD:
     birthday: date = None,
     photo_id: str = None
   ):
-    user = await self.get_user(session, tg_id)
+    values = {}
+    for column, value in (('username', username), ('name', name), ('birthday', birthday), ('photo_id', photo_id)):
+      if value == 'Не указывать':
+        values[column] = None
+      elif value != 'Оставить текущее':
+        values[column] = value
+
+    if not values:
+      return
 
+    # Старые значения берём из снимка строки до обновления, чтобы
+    # одним запросом узнать, что изменилось
+    old = (
+      select(User.tg_id, User.birthday)
+      .where(User.tg_id == str(tg_id))
+      .subquery('old')
+    )
+    query = (
+      update(User)
+      .where(
+        User.tg_id == old.c.tg_id,
+        or_(*(getattr(User, column).is_distinct_from(value) for column, value in values.items()))
+      )
+      .values(**values)
+      .returning(old.c.birthday, User.birthday)
+      .execution_options(synchronize_session=False)
+    )
+    changed = (await session.execute(query)).one_or_none()
 
-    if not user:
+    if changed is None:
       return
-    
-    if username == 'Не указывать':
-      user.username = None
-    elif username != 'Оставить текущее':
-      user.username = username
-
-    if name == 'Не указывать':
-      user.name = None
-    elif name != 'Оставить текущее':
-      user.name = name
-    
-    if birthday == 'Не указывать':
-      user.birthday = None
-    elif birthday != 'Оставить текущее':
-      user.birthday = birthday
-    
-    if photo_id == 'Не указывать':
-      user.photo_id = None
-    elif photo_id != 'Оставить текущее':
-      user.photo_id = photo_id
 
-user_crud = UserCRUD()
\ No newline at end of file
+    old_birthday, new_birthday = changed
+    months = {birthday.month for birthday in (old_birthday, new_birthday) if birthday}
+    await self._invalidate(session, tg_id, months, roster_changed=True)
+
+user_crud = UserCRUD()
+
+@instrument(crud_seconds, 'group.')
+class GroupCRUD:
+  async def upsert_group(
+    self,
+    session: AsyncSession,
+    chat_id: int,
+    title: str | None
+  ):
+    # Бота могли вернуть в чат — снова включаем рассылку
+    query = insert(Group).values(chat_id=str(chat_id), title=title)
+    query = query.on_conflict_do_update(
+      index_elements=[Group.chat_id],
+      set_={'title': query.excluded.title, 'blocked_at': None}
+    )
+    await session.execute(query)
+
+  async def join(
+    self,
+    session: AsyncSession,
+    chat_id: int,
+    title: str | None,
+    tg_id: int,
+    username: str | None
+  ) -> bool:
+    """Добавить пользователя в группу; False, если он уже в ней"""
+    await self.upsert_group(session, chat_id, title)
+    await user_crud.create_user(session, tg_id, username)
+
+    query = (
+      insert(Membership)
+      .values(group_id=str(chat_id), user_id=str(tg_id))
+      .on_conflict_do_nothing()
+      .returning(Membership.user_id)
+    )
+    if (await session.execute(query)).scalar_one_or_none() is None:
+      return False
+
+    await user_crud._invalidate(session, tg_id, roster_changed=True, group_id=str(chat_id))
+    return True
+
+  async def leave(
+    self,
+    session: AsyncSession,
+    chat_id: int,
+    tg_id: int
+  ) -> bool:
+    query = (
+      delete(Membership)
+      .where(Membership.group_id == str(chat_id), Membership.user_id == str(tg_id))
+      .returning(Membership.user_id)
+    )
+    if (await session.execute(query)).scalar_one_or_none() is None:
+      return False
+
+    await user_crud._invalidate(session, tg_id, roster_changed=True, group_id=str(chat_id))
+    return True
+
+  async def set_timezone(
+    self,
+    session: AsyncSession,
+    chat_id: int,
+    tz: str
+  ):
+    query = update(Group).where(Group.chat_id == str(chat_id)).values(timezone=tz)
+    await session.execute(query)
+
+  async def get_notify_timezones(
+    self,
+    session: AsyncSession
+  ) -> list[str]:
+    query = select(Group.timezone).where(Group.blocked_at.is_(None)).distinct()
+    return list((await session.execute(query)).scalars())
+
+  async def get_birthdays_on(
+    self,
+    session: AsyncSession,
+    tz: str,
+    month: int,
+    day: int
+  ) -> dict[str, list[CachedUser]]:
+    """Именинники дня по группам пояса tz одним запросом: group_id -> пользователи"""
+    query = (
+      select(Membership.group_id, User)
+      .join(User, User.tg_id == Membership.user_id)
+      .join(Group, Group.chat_id == Membership.group_id)
+      .where(
+        Group.timezone == tz,
+        Group.blocked_at.is_(None),
+        extract('month', User.birthday) == month,
+        extract('day', User.birthday) == day
+      )
+    )
+
+    birthdays: dict[str, list[CachedUser]] = {}
+    for group_id, user in (await session.execute(query)).all():
+      birthdays.setdefault(group_id, []).append(CachedUser.from_user(user))
+
+    return birthdays
+
+  async def mark_blocked(
+    self,
+    session: AsyncSession,
+    chat_ids: list[str]
+  ):
+    if not chat_ids:
+      return
+
+    query = (
+      update(Group)
+      .where(Group.chat_id.in_([str(chat_id) for chat_id in chat_ids]))
+      .values(blocked_at=datetime.now(timezone.utc).replace(tzinfo=None))
+    )
+    await session.execute(query)
+
+group_crud = GroupCRUD()
\ No newline at end of file
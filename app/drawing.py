@@ -1,16 +1,47 @@
-from datetime import datetime, timedelta, timezone, date
+from collections import OrderedDict
+import asyncio
+import functools
+from datetime import datetime, timedelta
 import calendar
+import io
 import os
+import threading
 
 from PIL import Image, ImageDraw, ImageFont
-from aiogram import Bot
 
+from config import settings
 from database import async_session_factory
-from app.crud import user_crud
+from app.birthdays import birthday_summary
+from app.render_pool import RenderExecutor, render_executor
+from app.photo_store import photo_store
+from app.metrics import calendar_phase_seconds, calendar_photos_missing
+from app.prefetch import photo_prefetcher
+from app.thumbnails import thumbnail_cache
+
+# Готовые сетки месяцев: (год, месяц, размеры, шрифт) -> изображение без фото
+TEMPLATE_CACHE_SIZE = 24
+_template_cache: OrderedDict[tuple, Image.Image] = OrderedDict()
+_template_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=32)
+def get_font(font_path, size):
+    """Шрифт из общего реестра, загружается один раз на процесс"""
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError as e:
+            print(f"Ошибка загрузки шрифта {font_path}: {e}")
+    return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=1024)
+def measure_text(text, font_path, size):
+    """Габариты надписи (как у ImageDraw.textbbox от точки (0, 0))"""
+    return get_font(font_path, size).getbbox(text)
 
 class CalendarGenerator:
     def __init__(self, year, month, cell_size=100, padding=10, 
-                 header_height=60, font_path=None):
+                 header_height=60, font_path=None,
+                 output_format='png', photo_format='jpeg', quality=85):
         self.year = year
         self.month = month
         self.cell_size = cell_size
@@ -18,6 +49,11 @@ class CalendarGenerator:
         self.header_height = header_height
         self.font_path = font_path
         
+        # Формат готовой картинки; auto выбирает по наличию фото
+        self.output_format = output_format
+        self.photo_format = photo_format
+        self.quality = quality
+        
         # Определяем дни недели и количество дней в месяце
         self.weekdays = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
         self.month_names = [
@@ -36,8 +72,28 @@ class CalendarGenerator:
         if 1 <= day <= self.num_days:
             self.image_replacements[day] = image_path
     
-    def generate_calendar(self, output_path="calendar.png"):
-        """Генерация календаря"""
+    def _template_key(self):
+        return (self.year, self.month, self.cell_size, self.padding,
+                self.header_height, self.font_path)
+    
+    def _get_template(self):
+        """Сетка месяца без фотографий, общая для всех рендеров этого месяца"""
+        key = self._template_key()
+        with _template_lock:
+            template = _template_cache.get(key)
+            if template is not None:
+                _template_cache.move_to_end(key)
+                return template
+        
+        template = self._build_template()
+        with _template_lock:
+            _template_cache[key] = template
+            while len(_template_cache) > TEMPLATE_CACHE_SIZE:
+                _template_cache.popitem(last=False)
+        return template
+    
+    def _build_template(self):
+        """Отрисовка заголовка, дней недели и всех чисел месяца"""
         # Рассчитываем размеры изображения
         width = self.cell_size * 7 + self.padding * 2
         height = (self.header_height * 2 + 
@@ -48,24 +104,14 @@ class CalendarGenerator:
         img = Image.new('RGB', (width, height), 'white')
         draw = ImageDraw.Draw(img)
         
-        # Загружаем шрифты
-        try:
-            if self.font_path:
-                title_font = ImageFont.truetype(self.font_path, 24)
-                weekday_font = ImageFont.truetype(self.font_path, 16)
-                day_font = ImageFont.truetype(self.font_path, 18)
-            else:
-                title_font = ImageFont.load_default()
-                weekday_font = ImageFont.load_default()
-                day_font = ImageFont.load_default()
-        except:
-            title_font = ImageFont.load_default()
-            weekday_font = ImageFont.load_default()
-            day_font = ImageFont.load_default()
+        # Шрифты берём из общего реестра
+        title_font = get_font(self.font_path, 24)
+        weekday_font = get_font(self.font_path, 16)
+        day_font = get_font(self.font_path, 18)
         
         # Рисуем заголовок с месяцем и годом
         title = f"{self.month_names[self.month - 1]} {self.year}"
-        title_bbox = draw.textbbox((0, 0), title, font=title_font)
+        title_bbox = measure_text(title, self.font_path, 24)
         title_width = title_bbox[2] - title_bbox[0]
         draw.text(((width - title_width) // 2, self.padding), 
                  title, fill='black', font=title_font)
@@ -76,7 +122,7 @@ class CalendarGenerator:
             x = self.padding + i * self.cell_size
             draw.rectangle([x, y_offset, x + self.cell_size, y_offset + 30], 
                           outline='black', fill='#f0f0f0')
-            day_bbox = draw.textbbox((0, 0), day, font=weekday_font)
+            day_bbox = measure_text(day, self.font_path, 16)
             day_width = day_bbox[2] - day_bbox[0]
             draw.text((x + (self.cell_size - day_width) // 2, 
                       y_offset + (30 - (day_bbox[3] - day_bbox[1])) // 2),
@@ -91,120 +137,208 @@ class CalendarGenerator:
         
         for week in range(6):  # Максимум 6 недель в месяце
             for day in range(7):
+                x = self.padding + day * self.cell_size
+                y = y_offset + week * self.cell_size
+                draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
+                              outline='black', fill='white')
+                
                 if (week == 0 and day < start_day) or day_count > self.num_days:
                     # Пустая клетка
-                    x = self.padding + day * self.cell_size
-                    y = y_offset + week * self.cell_size
-                    draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
-                                  outline='black', fill='white')
-                else:
-                    # Клетка с числом или изображением
-                    x = self.padding + day * self.cell_size
-                    y = y_offset + week * self.cell_size
-                    
-                    if day_count in self.image_replacements:
-                        # Вставляем изображение вместо числа
-                        self._insert_image(draw, img, x, y, day_count)
-                    else:
-                        # Рисуем число
-                        draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
-                                      outline='black', fill='white')
-                        
-                        # Определяем цвет текста (выходные - красный)
-                        text_color = 'red' if day in [5, 6] else 'black'
-                        
-                        day_str = str(day_count)
-                        day_bbox = draw.textbbox((0, 0), day_str, font=day_font)
-                        day_width = day_bbox[2] - day_bbox[0]
-                        day_height = day_bbox[3] - day_bbox[1]
-                        
-                        draw.text((x + (self.cell_size - day_width) // 2, 
-                                  y + (self.cell_size - day_height) // 2),
-                                 day_str, fill=text_color, font=day_font)
-                    
-                    day_count += 1
-                    
-                    if day_count > self.num_days:
-                        break
+                    continue
+                
+                # Определяем цвет текста (выходные - красный)
+                text_color = 'red' if day in [5, 6] else 'black'
+                
+                day_str = str(day_count)
+                day_bbox = measure_text(day_str, self.font_path, 18)
+                day_width = day_bbox[2] - day_bbox[0]
+                day_height = day_bbox[3] - day_bbox[1]
+                
+                draw.text((x + (self.cell_size - day_width) // 2, 
+                          y + (self.cell_size - day_height) // 2),
+                         day_str, fill=text_color, font=day_font)
+                
+                day_count += 1
+                
+                if day_count > self.num_days:
+                    break
             if day_count > self.num_days:
                 break
         
+        return img
+    
+    def _cell_position(self, day):
+        """Координаты левого верхнего угла клетки дня"""
+        index = self.first_day.weekday() + day - 1
+        x = self.padding + (index % 7) * self.cell_size
+        y = self.header_height + self.padding + 40 + (index // 7) * self.cell_size
+        return x, y
+    
+    def generate_calendar(self, output_path="calendar.png"):
+        """Генерация календаря"""
+        # Копируем готовую сетку и вставляем только фотографии
+        img = self._get_template().copy()
+        draw = ImageDraw.Draw(img)
+        
+        for day in sorted(self.image_replacements):
+            x, y = self._cell_position(day)
+            self._insert_image(draw, img, x, y, day)
+        
         # Сохраняем изображение
-        img.save(output_path)
+        if output_path:
+            img.save(output_path)
         return img
     
+    def generate_calendar_bytes(self, format=None):
+        """Генерация календаря в память, без записи на диск"""
+        return self.encode(self.generate_calendar(output_path=None), format=format)
+    
+    def resolved_format(self):
+        return resolve_format(self.output_format, self.photo_format, bool(self.image_replacements))
+    
+    def encode(self, img, format=None):
+        """Кодирование готового календаря в байты, по умолчанию в формате генератора"""
+        return encode_image(img, (format or self.resolved_format()).lower(), self.quality)
+    
     def _insert_image(self, draw, img, x, y, day):
         """Вставка изображения в клетку календаря"""
         image_path = self.image_replacements[day]
         
         try:
-            # Загружаем и обрабатываем изображение
-            day_image = Image.open(image_path)
-            day_image = day_image.convert('RGBA')
-            
-            # Масштабируем изображение под размер клетки
-            day_image = day_image.resize((self.cell_size, self.cell_size), 
-                                       Image.Resampling.LANCZOS)
-            
-            # Вставляем изображение
-            img.paste(day_image, (x, y), day_image if day_image.mode == 'RGBA' else None)
-            
-            # Рисуем рамку вокруг изображения
-            draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
-                          outline='black')
-            
+            # Берём уже уменьшенную под клетку RGBA-плитку из кэша
+            day_image = thumbnail_cache.get(image_path, self.cell_size)
         except Exception as e:
-            # Если не удалось загрузить изображение, рисуем число
+            # Если не удалось загрузить изображение, в клетке остаётся число из шаблона
             print(f"Ошибка загрузки изображения для дня {day}: {e}")
-            draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
-                          outline='black', fill='white')
-            
-            day_str = str(day)
-            day_bbox = draw.textbbox((0, 0), day_str, font=ImageFont.load_default())
-            day_width = day_bbox[2] - day_bbox[0]
-            day_height = day_bbox[3] - day_bbox[1]
-            
-            draw.text((x + (self.cell_size - day_width) // 2, 
-                      y + (self.cell_size - day_height) // 2),
-                     day_str, fill='black', font=ImageFont.load_default())
+            return
+        
+        # Закрываем число из шаблона и вставляем изображение
+        draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], fill='white')
+        img.paste(day_image, (x, y), day_image if day_image.mode == 'RGBA' else None)
+        
+        # Рисуем рамку вокруг изображения
+        draw.rectangle([x, y, x + self.cell_size, y + self.cell_size], 
+                      outline='black')
             
 
-async def generate_calendar_with_photos(bot: Bot, year, month, output_path='calendar.png'):
+# Форматы картинок: palette — PNG с палитрой, jpeg и webp — с потерями и качеством quality
+OUTPUT_FORMATS = ('png', 'palette', 'jpeg', 'webp')
+PALETTE_COLORS = 32
+
+def resolve_format(format, photo_format, has_photos):
+    """auto: без фото сетка из нескольких цветов и PNG с палитрой почти без потерь, с фото — photo_format"""
+    if format != 'auto':
+        return format
+    return photo_format if has_photos else 'palette'
+
+def encode_image(img, format='png', quality=85):
+    buffer = io.BytesIO()
+    if format == 'palette':
+        # Октодерево в разы быстрее median cut, а для сетки из пары цветов не хуже
+        img.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG')
+    elif format == 'jpeg':
+        img.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True)
+    elif format == 'webp':
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def image_extension(data):
+    """Расширение по сигнатуре: кэши хранят только байты картинки"""
+    if data.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return 'png'
+
+def render_month_tile(generator: CalendarGenerator, width: int) -> Image.Image:
+    """Месяц с фотографиями, уменьшенный до ширины width, для обзора года"""
+    img = generator.generate_calendar(output_path=None)
+    height = round(img.height * width / img.width)
+    return img.resize((width, height), Image.Resampling.LANCZOS)
+
+def compose_year_overview(year, tiles, columns=4, padding=20, header_height=60, font_path=None, format='png', quality=85):
+    """Лист с 12 месяцами года сеткой columns x (12 / columns)"""
+    tile_width, tile_height = tiles[0].size
+    rows = -(-len(tiles) // columns)
+    width = columns * tile_width + (columns + 1) * padding
+    height = header_height + rows * tile_height + (rows + 1) * padding
+
+    sheet = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(sheet)
+
+    title = str(year)
+    title_bbox = measure_text(title, font_path, 36)
+    draw.text(((width - (title_bbox[2] - title_bbox[0])) // 2, padding),
+              title, fill='black', font=get_font(font_path, 36))
+
+    for index, tile in enumerate(tiles):
+        x = padding + (index % columns) * (tile_width + padding)
+        y = header_height + padding + (index // columns) * (tile_height + padding)
+        sheet.paste(tile, (x, y))
+
+    return encode_image(sheet, format, quality)
+
+
+FONT_PATH = './app/Roboto-Regular.ttf'
+OVERVIEW_TILE_WIDTH = 440
+
+async def _prepare_month(session, year, month, group_id: str | None) -> tuple[CalendarGenerator, list]:
+  entries = await birthday_summary.month_entries(session, month, group_id=group_id)
+  cl = CalendarGenerator(
+    year=year, month=month, cell_size=120, padding=20, font_path=FONT_PATH,
+    output_format=settings.CALENDAR_FORMAT,
+    photo_format=settings.CALENDAR_PHOTO_FORMAT,
+    quality=settings.CALENDAR_QUALITY
+  )
+
+  for entry in entries:
+    user = entry.user
+    image_path = None
+    if user.photo_id:
+      image_path = photo_store.path(user.photo_id)
+      if image_path is None:
+        # Не ждём сеть: рисуем заглушку, фото докачается в фоне
+        calendar_photos_missing.inc()
+        photo_prefetcher.enqueue(user.tg_id, user.photo_id)
+
+    cl.add_image_replacement(user.birthday.day, image_path=image_path or 'app/images/None.png')
+
+  return cl, entries
+
+async def generate_calendars_with_photos(
+  months: list[tuple[int, int]],
+  group_id: str | None = None,
+  executor: RenderExecutor = render_executor
+) -> list[tuple[bytes, str]]:
+  """Несколько месяцев за один проход: составы из одной сессии, отрисовка параллельно в пуле"""
+  with calendar_phase_seconds.labels(phase='db').time():
+    async with async_session_factory() as session:
+      prepared = [await _prepare_month(session, year, month, group_id) for year, month in months]
+
+  # Отрисовка уходит в пул, соединение с БД к этому моменту уже отпущено
+  images = await asyncio.gather(*(executor.render(cl) for cl, _ in prepared))
+
+  return [
+    (image, birthday_summary.calendar_caption(entries))
+    for image, (_, entries) in zip(images, prepared)
+  ]
+
+async def generate_calendar_with_photos(year, month, group_id: str | None = None) -> tuple[bytes, str]:
+  return (await generate_calendars_with_photos([(year, month)], group_id))[0]
+
+async def generate_year_overview(year, group_id: str | None = None) -> tuple[bytes, str]:
+  """Обзор 12 месяцев года на одном листе"""
   async with async_session_factory() as session:
-    users = await user_crud.get_all_users(session)
-    cl = CalendarGenerator(year=year, month=month, cell_size=120, padding=20, font_path='./app/Roboto-Regular.ttf')
-
-    for user in users:
-      if (user.installed_at == None or user.installed_at < user.updated_at) and user.photo_id:
-        user.installed_at = datetime.now(timezone.utc).replace(tzinfo=None)
-        file = await bot.get_file(user.photo_id)
-        await bot.download_file(file.file_path, f'app/images/{user.photo_id}.jpg')
-
-      if not user.birthday:
-        continue
-
-      if user.birthday.month == month and user.photo_id:
-        cl.add_image_replacement(user.birthday.day, image_path=f'app/images/{user.photo_id}.jpg')
-      
-      if user.birthday.month == month and (not user.photo_id):
-        cl.add_image_replacement(user.birthday.day, image_path=f'app/images/None.png')
-
-    cl.generate_calendar(output_path=output_path)
-
-    await session.commit()
-
-  caption = ''
-  for user in users:
-    if not user.birthday:
-      continue
-    if user.birthday.month == month:
-      today = date.today()
-      age = today.year - user.birthday.year
-      
-      # Проверяем, был ли уже день рождения в этом году
-      if today.month < user.birthday.month or (today.month == user.birthday.month and today.day < user.birthday.day):
-          age -= 1
-
-      caption += f'{user.birthday.day}.{user.birthday.month}.{user.birthday.year}: {user.name} - @{user.username} (исполняется {(age+1)})\n' 
-  
-  return caption
\ No newline at end of file
+    prepared = [await _prepare_month(session, year, month, group_id) for month in range(1, 13)]
+
+  tiles = await asyncio.gather(*(
+    render_executor.run(render_month_tile, cl, OVERVIEW_TILE_WIDTH) for cl, _ in prepared
+  ))
+  total = sum(len(entries) for _, entries in prepared)
+  format = resolve_format(settings.CALENDAR_FORMAT, settings.CALENDAR_PHOTO_FORMAT, total > 0)
+  image = await render_executor.run(
+    compose_year_overview, year, tiles, 4, 20, 60, FONT_PATH, format, settings.CALENDAR_QUALITY
+  )
+  return image, f'Дни рождения в {year} году: {total}'
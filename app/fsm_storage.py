@@ -0,0 +1,70 @@
+import json
+from datetime import date
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import FSMRecord
+from database import async_session_factory
+
+
+def _default(value):
+  # В данных анкеты лежит дата рождения
+  if isinstance(value, date):
+    return {'__date__': value.isoformat()}
+  raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _object_hook(obj: dict):
+  if obj.keys() == {'__date__'}:
+    return date.fromisoformat(obj['__date__'])
+  return obj
+
+
+class PostgresStorage(BaseStorage):
+  """FSM-хранилище в таблице fsm_states, общее для всех реплик бота"""
+
+  def __init__(self, key_builder: KeyBuilder | None = None):
+    self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+  async def _write(self, key: StorageKey, values: dict[str, Any]) -> None:
+    record_key = self.key_builder.build(key)
+    query = (
+      insert(FSMRecord)
+      .values(key=record_key, **values)
+      .on_conflict_do_update(index_elements=[FSMRecord.key], set_=values)
+    )
+    async with async_session_factory() as session:
+      await session.execute(query)
+      if values.get('state', '') is None or values.get('data') == '{}':
+        # Запись без состояния и данных не хранится: без неё get_* вернут то же самое
+        await session.execute(
+          delete(FSMRecord)
+          .where(FSMRecord.key == record_key, FSMRecord.state.is_(None), FSMRecord.data == '{}')
+        )
+      await session.commit()
+
+  async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+    state = state.state if isinstance(state, State) else state
+    await self._write(key, {'state': state})
+
+  async def get_state(self, key: StorageKey) -> str | None:
+    query = select(FSMRecord.state).where(FSMRecord.key == self.key_builder.build(key))
+    async with async_session_factory() as session:
+      return (await session.execute(query)).scalar_one_or_none()
+
+  async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+    payload = json.dumps(dict(data), default=_default, ensure_ascii=False)
+    await self._write(key, {'data': payload})
+
+  async def get_data(self, key: StorageKey) -> dict[str, Any]:
+    query = select(FSMRecord.data).where(FSMRecord.key == self.key_builder.build(key))
+    async with async_session_factory() as session:
+      payload = (await session.execute(query)).scalar_one_or_none()
+
+    return json.loads(payload, object_hook=_object_hook) if payload else {}
+
+  async def close(self) -> None:
+    pass
@@ -2,16 +2,21 @@ import json
 from datetime import datetime, timezone, date
 
 import aiofiles
+import pytz
 from aiogram import Router, F
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, FSInputFile, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
+from aiogram.types import Chat, Message, BufferedInputFile, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto
 
 from database import async_session_factory
 import app.keyboards as kb
-from app.crud import user_crud
-from app.drawing import generate_calendar_with_photos
+from app.crud import group_crud, user_crud
+from app.drawing import generate_calendar_with_photos, generate_year_overview, image_extension
+from app.calendar_cache import calendar_cache
+from app.prewarm import calendar_prewarmer
+from app.prefetch import photo_prefetcher
+from app.metrics import HandlerMetricsMiddleware
 
 class SetProfileInfo(StatesGroup):
   photo = State()
@@ -20,9 +25,24 @@ class SetProfileInfo(StatesGroup):
 
 
 router = Router()
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
 from main import bot
 
 
+def chat_scope(chat: Chat) -> str | None:
+  # В группах календарь строится только по участникам группы
+  return str(chat.id) if chat.type in ('group', 'supergroup') else None
+
+async def render_calendar(year: int, month: int, roster_version: int, group_id: str | None) -> tuple[bytes, str]:
+  # Месяц мог быть отрисован заранее, пока пользователь смотрел соседний
+  rendered = calendar_cache.get_image(year, month, roster_version, group_id)
+  if rendered:
+    return rendered.image, rendered.caption
+
+  return await generate_calendar_with_photos(year=year, month=month, group_id=group_id)
+
+
 @router.message(CommandStart())
 async def start(msg: Message):
   text = (
@@ -31,31 +51,38 @@ async def start(msg: Message):
     'Также можете настроить свой профиль, чтобы другие студенты могли вовремя поздравить вас'
   )
   await msg.answer(text, reply_markup=kb.start_keyboard, parse_mode='Markdown')
-  try:
-    async with async_session_factory() as session:
-      await user_crud.create_user(session, msg.from_user.id, msg.from_user.username)
-      await session.commit()
-  except Exception:
-    print('Пользователь существует')
+  async with async_session_factory() as session:
+    await user_crud.create_user(session, msg.from_user.id, msg.from_user.username)
+    await session.commit()
 
+@router.message(Command('calendar'))
 @router.message(F.text == 'Посмотреть Календарь')
 async def calendar_message(msg: Message, state: FSMContext):
   today = date.today()
-  
-  caption = await generate_calendar_with_photos(bot=bot, year=today.year, month=today.month, output_path='./app/images/calendar.png')
+  group_id = chat_scope(msg.chat)
 
   markup = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text='←-', callback_data=f'calendar_year={today.year if today.month-1 > 0 else today.year-1},month={today.month-1 if today.month-1 > 0 else 12}'),
     InlineKeyboardButton(text='-→', callback_data=f'calendar_year={today.year if today.month+1 < 13 else today.year+1},month={today.month+1 if today.month+1 < 13 else 1}')]
   ])
 
+  roster_version = user_crud.roster_version(today.month)
+  cached = calendar_cache.get(today.year, today.month, roster_version, group_id)
+  if cached:
+    await bot.send_photo(chat_id=msg.chat.id, photo=cached.file_id, caption=cached.caption, reply_markup=markup)
+  else:
+    image, caption = await render_calendar(today.year, today.month, roster_version, group_id)
 
+    sent = await bot.send_photo(chat_id=msg.chat.id, photo=BufferedInputFile(image, filename=f'calendar.{image_extension(image)}'), caption=caption, reply_markup=markup)
+    calendar_cache.set(today.year, today.month, roster_version, sent.photo[-1].file_id, caption, group_id)
 
-  await bot.send_photo(chat_id=msg.chat.id, photo=FSInputFile('./app/images/calendar.png'), caption=caption, reply_markup=markup)
+  # Соседние месяцы — только после ответа, чтобы не задерживать запрошенный
+  calendar_prewarmer.schedule(today.year, today.month, group_id)
     
 @router.callback_query(F.data.startswith('calendar_year='))
 async def calendar_callback(callback: CallbackQuery):
   data = callback.data
+  group_id = chat_scope(callback.message.chat)
 
   params = {}
   for part in data.split(','):
@@ -66,20 +93,51 @@ async def calendar_callback(callback: CallbackQuery):
   year = int(params.get('calendar_year', datetime.now().year))
   month = int(params.get('month', datetime.now().month))
 
-  caption = await generate_calendar_with_photos(bot=bot, year=year, month=month, output_path='./app/images/calendar.png')
-
   markup = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text='←-', callback_data=f'calendar_year={year if month-1 > 0 else year-1},month={month-1 if month-1 > 0 else 12}'),
     InlineKeyboardButton(text='-→', callback_data=f'calendar_year={year if month+1 < 13 else year+1},month={month+1 if month+1 < 13 else 1}')]
   ])
-        
-  await callback.message.edit_media(
-    media=InputMediaPhoto(
-      media=FSInputFile('./app/images/calendar.png'),
-      caption=caption
-    ),
-    reply_markup=markup
-  )
+
+  roster_version = user_crud.roster_version(month)
+  cached = calendar_cache.get(year, month, roster_version, group_id)
+  if cached:
+    await callback.message.edit_media(
+      media=InputMediaPhoto(media=cached.file_id, caption=cached.caption),
+      reply_markup=markup
+    )
+  else:
+    image, caption = await render_calendar(year, month, roster_version, group_id)
+
+    edited = await callback.message.edit_media(
+      media=InputMediaPhoto(
+        media=BufferedInputFile(image, filename=f'calendar.{image_extension(image)}'),
+        caption=caption
+      ),
+      reply_markup=markup
+    )
+    if isinstance(edited, Message) and edited.photo:
+      calendar_cache.set(year, month, roster_version, edited.photo[-1].file_id, caption, group_id)
+
+  calendar_prewarmer.schedule(year, month, group_id)
+
+@router.message(Command('year'))
+async def year_overview(msg: Message, command: CommandObject):
+  year = date.today().year
+  if command.args and command.args.strip().isdigit() and 1 <= int(command.args) <= 9999:
+    year = int(command.args)
+  group_id = chat_scope(msg.chat)
+
+  # Обзор года хранится в кэше календарей как месяц 0
+  roster_version = user_crud.roster_version(0)
+  cached = calendar_cache.get(year, 0, roster_version, group_id)
+  if cached:
+    await bot.send_photo(chat_id=msg.chat.id, photo=cached.file_id, caption=cached.caption)
+    return
+
+  image, caption = await generate_year_overview(year, group_id)
+
+  sent = await bot.send_photo(chat_id=msg.chat.id, photo=BufferedInputFile(image, filename=f'year.{image_extension(image)}'), caption=caption)
+  calendar_cache.set(year, 0, roster_version, sent.photo[-1].file_id, caption, group_id)
 
 @router.message(F.text == 'Профиль')
 async def profile(msg: Message):
@@ -93,7 +151,8 @@ async def profile(msg: Message):
     text = (
       f'Username: {'@' + user.username or '-'}\n'
       f'Имя: {user.name or 'Не указано'}\n'
-      f'Дата рождения: {user.birthday or 'Не указано'}'
+      f'Дата рождения: {user.birthday or 'Не указано'}\n'
+      f'Часовой пояс: {user.timezone}'
     )
 
     if user.photo_id:
@@ -107,6 +166,61 @@ async def profile(msg: Message):
     else:
       await msg.answer(text+'\nФотография: Не указано', reply_markup=kb.profile_keyboard)
 
+@router.message(Command('timezone'))
+async def set_timezone(msg: Message, command: CommandObject):
+  tz = (command.args or '').strip()
+
+  if not tz:
+    await msg.answer(
+      'Поздравления приходят после полуночи по вашему часовому поясу.\n'
+      'Укажите его в формате IANA, например: `/timezone Asia/Yekaterinburg`',
+      parse_mode='Markdown'
+    )
+    return
+
+  if tz not in pytz.all_timezones_set:
+    await msg.answer('*Неизвестный часовой пояс*\nПримеры: Europe/Moscow, Asia/Novosibirsk, UTC', parse_mode='Markdown')
+    return
+
+  if chat_scope(msg.chat):
+    # В группе пояс общий для чата, менять его могут только админы
+    member = await bot.get_chat_member(msg.chat.id, msg.from_user.id)
+    if member.status not in ('administrator', 'creator'):
+      await msg.answer('Часовой пояс группы могут менять только администраторы')
+      return
+
+    async with async_session_factory() as session:
+      await group_crud.upsert_group(session, msg.chat.id, msg.chat.title)
+      await group_crud.set_timezone(session, msg.chat.id, tz)
+      await session.commit()
+
+    await msg.answer(f'Часовой пояс группы: {tz}')
+    return
+
+  async with async_session_factory() as session:
+    await user_crud.create_user(session, msg.from_user.id, msg.from_user.username)
+    await user_crud.set_timezone(session, msg.from_user.id, tz)
+    await session.commit()
+
+  await msg.answer(f'Часовой пояс: {tz}')
+
+@router.message(Command('join', 'leave'), F.chat.type.in_({'group', 'supergroup'}))
+async def group_membership(msg: Message, command: CommandObject):
+  async with async_session_factory() as session:
+    if command.command == 'join':
+      changed = await group_crud.join(session, msg.chat.id, msg.chat.title, msg.from_user.id, msg.from_user.username)
+      text = 'Вы добавлены в календарь группы' if changed else 'Вы уже в календаре группы'
+    else:
+      changed = await group_crud.leave(session, msg.chat.id, msg.from_user.id)
+      text = 'Вы удалены из календаря группы' if changed else 'Вас нет в календаре группы'
+    await session.commit()
+
+  await msg.reply(text)
+
+@router.message(Command('join', 'leave'))
+async def group_membership_private(msg: Message):
+  await msg.answer('Команда работает в групповом чате: добавьте бота в группу и отправьте /join там')
+
 @router.message(F.text == 'Обновить свою информацию')
 async def set_information(msg: Message, state: FSMContext):
   await state.set_state(SetProfileInfo.photo)
@@ -182,6 +296,9 @@ async def set_birthday(msg: Message, state: FSMContext):
       photo_id=data['file_id']
     )
     await session.commit()
+
+  if data['file_id'] not in ['Не указывать', 'Оставить текущее']:
+    photo_prefetcher.enqueue(msg.from_user.id, data['file_id'])
   
   await msg.answer('Вся информация добавлена в ваш профиль.', reply_markup=kb.start_keyboard)
   await state.clear()
\ No newline at end of file
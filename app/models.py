@@ -1,6 +1,6 @@
 from datetime import datetime, date
 
-from sqlalchemy import text
+from sqlalchemy import ForeignKey, Index, extract, or_, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from database import Base
@@ -15,4 +15,69 @@ class User(Base):
   photo_id: Mapped[str | None]
 
   installed_at: Mapped[datetime | None]
-  updated_at: Mapped[datetime | None] = mapped_column(server_default=text("TIMEZONE('utc', now())"), onupdate=datetime.utcnow)
\ No newline at end of file
+  updated_at: Mapped[datetime | None] = mapped_column(server_default=text("TIMEZONE('utc', now())"), onupdate=datetime.utcnow)
+
+  # Когда пользователь заблокировал бота; такие чаты пропускаются в рассылках
+  blocked_at: Mapped[datetime | None]
+
+  # IANA-пояс пользователя: поздравления приходят после его местной полуночи
+  timezone: Mapped[str] = mapped_column(server_default='Europe/Moscow')
+
+# Выборки по месяцу/дню рождения идут по этому индексу, а не полным сканом
+Index('ix_users_birth_month_day', extract('month', User.birthday), extract('day', User.birthday))
+
+# Частичный индекс по строкам, фото которых ещё не загружено после обновления
+Index(
+  'ix_users_stale_photo',
+  User.tg_id,
+  postgresql_where=User.photo_id.is_not(None) & or_(User.installed_at.is_(None), User.installed_at < User.updated_at)
+)
+
+# Получатели рассылки одного пояса, без заблокировавших бота, по порядку tg_id
+Index('ix_users_timezone', User.timezone, User.tg_id, postgresql_where=User.blocked_at.is_(None))
+
+class Group(Base):
+  """Групповой чат со своим составом, календарём и рассылкой"""
+  __tablename__ = 'groups'
+
+  chat_id: Mapped[str] = mapped_column(primary_key=True)
+  title: Mapped[str | None]
+  timezone: Mapped[str] = mapped_column(server_default='Europe/Moscow')
+  created_at: Mapped[datetime] = mapped_column(server_default=text("TIMEZONE('utc', now())"))
+  # Бота удалили из чата
+  blocked_at: Mapped[datetime | None]
+
+Index('ix_groups_timezone', Group.timezone, postgresql_where=Group.blocked_at.is_(None))
+
+class Membership(Base):
+  __tablename__ = 'memberships'
+
+  # Первичный ключ (group_id, user_id) обслуживает выборки состава группы
+  group_id: Mapped[str] = mapped_column(ForeignKey('groups.chat_id', ondelete='CASCADE'), primary_key=True)
+  user_id: Mapped[str] = mapped_column(ForeignKey('users.tg_id', ondelete='CASCADE'), primary_key=True)
+  joined_at: Mapped[datetime] = mapped_column(server_default=text("TIMEZONE('utc', now())"))
+
+# Проверка «состоит ли пользователь в какой-нибудь группе» для личной рассылки
+Index('ix_memberships_user_id', Membership.user_id)
+
+class FSMRecord(Base):
+  """Состояние и данные FSM одного пользователя (см. app/fsm_storage.py)"""
+  __tablename__ = 'fsm_states'
+
+  key: Mapped[str] = mapped_column(primary_key=True)
+  state: Mapped[str | None]
+  data: Mapped[str] = mapped_column(server_default='{}')
+
+class JobRun(Base):
+  """Отметка о запуске ежедневной задачи, чтобы из нескольких реплик её выполнила одна.
+
+  Незавершённую (finished_at пуст) отметку, которую не продлевали дольше
+  SCHEDULER_CLAIM_LEASE, может перехватить следующий запуск — так задача
+  переживает падение реплики. Отметки старше двух дней удаляет finish_daily_run.
+  """
+  __tablename__ = 'job_runs'
+
+  job: Mapped[str] = mapped_column(primary_key=True)
+  run_date: Mapped[date] = mapped_column(primary_key=True)
+  started_at: Mapped[datetime] = mapped_column(server_default=text("TIMEZONE('utc', now())"))
+  finished_at: Mapped[datetime | None]
\ No newline at end of file
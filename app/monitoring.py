@@ -0,0 +1,123 @@
+import asyncio
+import cProfile
+import hmac
+import io
+import logging
+import pstats
+
+from aiohttp import web
+from prometheus_client import REGISTRY
+from prometheus_client.exposition import choose_encoder
+
+from config import settings
+from database import engine, pool_metrics
+from app.crud import user_crud
+from app.metrics import callbacks
+
+try:
+  from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+  SamplingProfiler = None
+
+logger = logging.getLogger(__name__)
+
+
+# Счётчики, которые уже ведут кэш профилей и пул соединений
+callbacks.counter('roster_cache_hits_total', 'Попадания в кэш профилей и составов', lambda: user_crud.cache.hits)
+callbacks.counter('roster_cache_misses_total', 'Промахи кэша профилей и составов', lambda: user_crud.cache.misses)
+callbacks.counter('db_pool_checkouts_total', 'Выдачи соединений из пула', lambda: pool_metrics.checkouts)
+callbacks.counter('db_pool_wait_seconds_total', 'Суммарное ожидание соединения из пула', lambda: pool_metrics.total_wait)
+callbacks.counter('db_pool_slow_waits_total', 'Ожидания соединения дольше DB_POOL_SLOW_WAIT', lambda: pool_metrics.slow_waits)
+callbacks.gauge('db_pool_checked_out', 'Занятые соединения пула', lambda: engine.pool.checkedout())
+
+
+class LoopProfiler:
+  """Профилирование потока event loop'а на заданное время, по запросу"""
+
+  MODES = ('cprofile', 'pyinstrument')
+
+  def __init__(self, max_seconds: float = 300):
+    self.max_seconds = max_seconds
+    self._lock = asyncio.Lock()
+
+  @property
+  def running(self) -> bool:
+    return self._lock.locked()
+
+  async def profile(self, seconds: float, mode: str = 'cprofile', sort: str = 'cumulative', limit: int = 60) -> str:
+    seconds = min(seconds, self.max_seconds)
+
+    async with self._lock:
+      logger.info('Профилирование %s на %s с', mode, seconds)
+      if mode == 'pyinstrument':
+        return await self._pyinstrument(seconds)
+      return await self._cprofile(seconds, sort, limit)
+
+  async def _cprofile(self, seconds: float, sort: str, limit: int) -> str:
+    # Профилировщик включается в потоке loop'а и видит все задачи, пока мы спим
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+      await asyncio.sleep(seconds)
+    finally:
+      profiler.disable()
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+  async def _pyinstrument(self, seconds: float) -> str:
+    if SamplingProfiler is None:
+      raise RuntimeError('pyinstrument не установлен')
+
+    # async_mode='disabled': семплируется весь поток, а не только эта задача
+    profiler = SamplingProfiler(interval=0.001, async_mode='disabled')
+    profiler.start()
+    try:
+      await asyncio.sleep(seconds)
+    finally:
+      profiler.stop()
+    return profiler.output_text(unicode=True, color=False)
+
+loop_profiler = LoopProfiler()
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+  # Текстовый формат или OpenMetrics — по заголовку Accept сборщика
+  encoder, content_type = choose_encoder(request.headers.get('Accept'))
+  return web.Response(body=encoder(REGISTRY), headers={'Content-Type': content_type, 'X-Content-Type-Options': 'nosniff'})
+
+async def profile_handler(request: web.Request) -> web.Response:
+  """GET /debug/profile?seconds=10&mode=cprofile|pyinstrument&sort=cumulative&limit=60"""
+  # Только заголовок: строка запроса попадает в логи доступа и прокси.
+  # Сравниваются байты: compare_digest не принимает строки не из ASCII, а
+  # aiohttp отдаёт невалидный UTF-8 в заголовке суррогатами
+  token = request.headers.get('X-Profile-Token', '').encode('utf-8', 'surrogateescape')
+  if not hmac.compare_digest(token, settings.PROFILE_TOKEN.encode()):
+    raise web.HTTPForbidden()
+
+  try:
+    seconds = float(request.query.get('seconds', 10))
+    limit = int(request.query.get('limit', 60))
+  except ValueError:
+    raise web.HTTPBadRequest(text='seconds и limit должны быть числами')
+  mode = request.query.get('mode', 'cprofile')
+  if mode not in LoopProfiler.MODES or seconds <= 0:
+    raise web.HTTPBadRequest(text=f'mode: {", ".join(LoopProfiler.MODES)}; seconds > 0')
+  if loop_profiler.running:
+    raise web.HTTPConflict(text='Профилирование уже идёт')
+
+  try:
+    report = await loop_profiler.profile(seconds, mode, request.query.get('sort', 'cumulative'), limit)
+  except RuntimeError as e:
+    raise web.HTTPNotImplemented(text=str(e))
+  except (KeyError, ValueError) as e:
+    # Неизвестный ключ сортировки или другой профилировщик уже активен
+    raise web.HTTPBadRequest(text=str(e))
+  return web.Response(text=report)
+
+def setup_monitoring(app: web.Application):
+  """Маршруты метрик и, если задан PROFILE_TOKEN, профилирования"""
+  app.router.add_get(settings.METRICS_PATH, metrics_handler)
+  if settings.PROFILE_TOKEN:
+    app.router.add_get('/debug/profile', profile_handler)
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from PIL import Image
+from aiogram import Bot
+
+from config import settings
+from app.metrics import photo_download_failures, photo_download_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def _verify(data: bytes):
+  Image.open(io.BytesIO(data)).verify()
+
+
+class PhotoStore:
+  """Локальное хранилище аватарок с адресацией по содержимому.
+
+  Файлы лежат как <sha256>.jpg, одинаковые фото разных пользователей хранятся
+  один раз. Индекс photo_id -> хэш хранится рядом в index.json. При превышении
+  лимита размера удаляются давно не использованные файлы: время использования
+  копится в памяти и переносится в atime файлов при записи и очистке.
+  """
+
+  def __init__(self, root: str, max_bytes: int):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.index_path = os.path.join(root, 'index.json')
+
+    os.makedirs(root, exist_ok=True)
+    self._index: dict[str, dict] = self._load_index()
+    # Индекс меняют потоки записи и очистки (put, prune); event loop его только
+    # читает. Под этим замком индекс сохраняется и удаляются файлы
+    self._index_lock = threading.Lock()
+    # Хэш -> время последнего использования, ещё не записанное в atime файла
+    self._used: dict[str, float] = {}
+    # Замок на photo_id живёт, пока его кто-то держит или ждёт
+    self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+  def _load_index(self) -> dict[str, dict]:
+    try:
+      with open(self.index_path, encoding='utf-8') as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {}
+
+  def _save_index(self):
+    # Вызывается под _index_lock
+    tmp_path = self.index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      json.dump(self._index, f)
+    os.replace(tmp_path, self.index_path)
+
+  def _file_path(self, digest: str) -> str:
+    return os.path.join(self.root, f'{digest}.jpg')
+
+  def path(self, photo_id: str) -> str | None:
+    """Путь к сохранённому фото или None, если его нужно скачать.
+
+    Вызывается из event loop'а на каждую клетку календаря, поэтому только
+    читает индекс в памяти: файл удаляется только после своей записи в индексе.
+    """
+    entry = self._index.get(photo_id)
+    if entry is None:
+      return None
+
+    self._used[entry['hash']] = time.time()
+    return self._file_path(entry['hash'])
+
+  async def fetch(self, bot: Bot, photo_id: str) -> str | None:
+    """Скачать фото, если его ещё нет в хранилище"""
+    if (file_path := self.path(photo_id)):
+      return file_path
+
+    lock = self._locks.get(photo_id)
+    if lock is None:
+      lock = self._locks[photo_id] = asyncio.Lock()
+
+    async with lock:
+      if (file_path := self.path(photo_id)):
+        return file_path
+
+      try:
+        with photo_download_seconds.time():
+          buffer = await bot.download(photo_id, destination=io.BytesIO())
+        data = buffer.getvalue()
+        # Разбор картинки и запись на диск — в потоке, чтобы не останавливать event loop
+        await asyncio.to_thread(_verify, data)
+      except Exception as e:
+        logger.warning('Не удалось скачать фото %s: %s', photo_id, e)
+        photo_download_failures.inc()
+        return None
+
+      try:
+        return await asyncio.to_thread(self.put, photo_id, data)
+      except OSError as e:
+        logger.warning('Не удалось сохранить фото %s: %s', photo_id, e)
+        return None
+
+  def put(self, photo_id: str, data: bytes) -> str:
+    """Сохранить фото; блокирует, из event loop'а вызывается через asyncio.to_thread"""
+    digest = hashlib.sha256(data).hexdigest()
+    file_path = self._file_path(digest)
+
+    # Запись и индекс под одним замком: иначе _evict из соседнего потока
+    # может удалить файл между записью и появлением его в индексе
+    with self._index_lock:
+      if not os.path.exists(file_path):
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+          f.write(data)
+        os.replace(tmp_path, file_path)
+
+      self._index[photo_id] = {'hash': digest, 'size': len(data)}
+      self._save_index()
+    self._evict()
+
+    return file_path
+
+  def _stored_files(self) -> list[os.DirEntry]:
+    return [
+      entry for entry in os.scandir(self.root)
+      if entry.is_file() and entry.name.endswith('.jpg')
+    ]
+
+  def _remove(self, digest: str):
+    try:
+      os.remove(self._file_path(digest))
+    except FileNotFoundError:
+      pass
+
+  def _flush_used(self):
+    # Вызывается под _index_lock. Пишется только atime: по mtime источника
+    # кэш миниатюр решает, не устарела ли плитка
+    used, self._used = self._used, {}
+    for digest, used_at in used.items():
+      file_path = self._file_path(digest)
+      try:
+        os.utime(file_path, (used_at, os.path.getmtime(file_path)))
+      except FileNotFoundError:
+        pass
+
+  def _evict(self):
+    with self._index_lock:
+      self._flush_used()
+      files = self._stored_files()
+      total = sum(entry.stat().st_size for entry in files)
+      if total <= self.max_bytes:
+        return
+
+      # Самые давно использованные — первыми
+      files.sort(key=lambda entry: entry.stat().st_atime)
+      evicted = set()
+      for entry in files:
+        if total <= self.max_bytes:
+          break
+        total -= entry.stat().st_size
+        evicted.add(entry.name.removesuffix('.jpg'))
+
+      # Сначала индекс, потом файлы: path() не должен вернуть удаляемый файл
+      self._index = {
+        photo_id: entry for photo_id, entry in self._index.items()
+        if entry['hash'] not in evicted
+      }
+      self._save_index()
+      for digest in evicted:
+        self._remove(digest)
+
+  def hashes(self) -> set[str]:
+    with self._index_lock:
+      return {entry['hash'] for entry in self._index.values()}
+
+  def prune(self, referenced_photo_ids: set[str]):
+    """Удалить фото, на которые больше не ссылается ни один пользователь; блокирует, как put.
+
+    Заодно из индекса уходят записи, чей файл пропал или обрезан: path() на диск не смотрит.
+    """
+    with self._index_lock:
+      self._flush_used()
+      sizes = {entry.name.removesuffix('.jpg'): entry.stat().st_size for entry in self._stored_files()}
+      self._index = {
+        photo_id: entry for photo_id, entry in self._index.items()
+        if photo_id in referenced_photo_ids and sizes.get(entry['hash']) == entry['size']
+      }
+      self._save_index()
+      used = {entry['hash'] for entry in self._index.values()}
+
+      removed = 0
+      for digest in sizes.keys() - used:
+        self._remove(digest)
+        removed += 1
+
+    logger.info('Очистка хранилища фото: удалено файлов %s', removed)
+
+photo_store = PhotoStore(
+  root=settings.PHOTO_STORE_DIR,
+  max_bytes=settings.PHOTO_STORE_MAX_MB * 1024 * 1024
+)
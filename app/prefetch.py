@@ -0,0 +1,70 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+
+from config import settings
+from database import async_session_factory
+from app.crud import user_crud
+from app.photo_store import photo_store
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoPrefetcher:
+  """Фоновая загрузка фото профилей, чтобы календарь не ждал сеть"""
+
+  def __init__(self, workers: int = 4, queue_size: int = 1000):
+    self.workers = workers
+    self._queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue(maxsize=queue_size)
+    self._pending: set[str] = set()
+    self._tasks: list[asyncio.Task] = []
+    self._bot: Bot | None = None
+
+  def start(self, bot: Bot):
+    self._bot = bot
+    self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+  async def stop(self):
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks = []
+
+  def enqueue(self, tg_id: int | str, photo_id: str):
+    if photo_id in self._pending:
+      return
+
+    try:
+      self._queue.put_nowait((str(tg_id), photo_id))
+    except asyncio.QueueFull:
+      logger.warning('Очередь загрузки фото переполнена, пропускаем %s', photo_id)
+      return
+
+    self._pending.add(photo_id)
+
+  async def _worker(self):
+    while True:
+      tg_id, photo_id = await self._queue.get()
+      try:
+        await self._process(tg_id, photo_id)
+      except Exception as e:
+        logger.exception('Ошибка фоновой загрузки фото %s: %s', photo_id, e)
+      finally:
+        self._pending.discard(photo_id)
+        self._queue.task_done()
+
+  async def _process(self, tg_id: str, photo_id: str):
+    if photo_store.path(photo_id):
+      return
+
+    if await photo_store.fetch(self._bot, photo_id) is None:
+      return
+
+    # Календари, отрисованные с заглушкой вместо этого фото, больше не актуальны:
+    # отметка installed_at сбрасывает месяц именинника здесь и на других репликах
+    async with async_session_factory() as session:
+      await user_crud.mark_photos_installed(session, [(tg_id, photo_id)])
+      await session.commit()
+
+photo_prefetcher = PhotoPrefetcher(workers=settings.PREFETCH_WORKERS)
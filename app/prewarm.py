@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+from config import settings
+from app.calendar_cache import calendar_cache
+from app.crud import user_crud
+from app.drawing import generate_calendars_with_photos
+from app.render_pool import prewarm_executor
+
+logger = logging.getLogger(__name__)
+
+
+def shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+  index = year * 12 + month - 1 + delta
+  return index // 12, index % 12 + 1
+
+
+class CalendarPrewarmer:
+  """Заранее отрисовывает соседние месяцы, на которые пользователь скорее всего перелистнёт.
+
+  Работа необязательная: отрисовка идёт в отдельном prewarm_executor с пониженным
+  приоритетом, а если уже идут max_batches подготовок, новые не запускаются.
+  Хендлеры вызывают schedule после ответа пользователю.
+  """
+
+  def __init__(self, months_ahead: int = 2, max_batches: int = 2):
+    self.months_ahead = months_ahead
+    self.max_batches = max_batches
+    self._pending: set[tuple] = set()
+    self._tasks: set[asyncio.Task] = set()
+
+  def schedule(self, year: int, month: int, group_id: str | None = None):
+    if not self.months_ahead or len(self._tasks) >= self.max_batches:
+      return
+
+    months = [
+      shift_month(year, month, delta)
+      for delta in (*range(1, self.months_ahead + 1), -1)
+    ]
+    # Ключ как в кэше календарей: у каждого месяца своя версия состава
+    keys = [
+      (group_id, year, month, user_crud.roster_version(month))
+      for year, month in months
+    ]
+    keys = [
+      key for key in keys
+      if not calendar_cache.contains(*key[1:], group_id) and key not in self._pending
+    ]
+    if not keys:
+      return
+
+    self._pending |= set(keys)
+
+    task = asyncio.create_task(self._prewarm(keys, group_id))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _prewarm(self, keys: list[tuple], group_id: str | None):
+    months = [(year, month) for _, year, month, _ in keys]
+    try:
+      rendered = await generate_calendars_with_photos(months, group_id, prewarm_executor)
+      for (_, year, month, roster_version), (image, caption) in zip(keys, rendered):
+        calendar_cache.set_image(year, month, roster_version, image, caption, group_id)
+    except Exception as e:
+      logger.exception('Ошибка предварительной отрисовки %s: %s', months, e)
+    finally:
+      self._pending -= set(keys)
+
+  async def stop(self):
+    tasks = list(self._tasks)
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    prewarm_executor.shutdown()
+
+calendar_prewarmer = CalendarPrewarmer(months_ahead=settings.CALENDAR_PREWARM_MONTHS)
@@ -0,0 +1,87 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import settings
+from app.metrics import calendar_image_bytes, calendar_phase_seconds
+
+def _lower_priority(increment: int):
+  # В потоке на Linux nice действует только на этот поток
+  if hasattr(os, 'nice'):
+    os.nice(increment)
+
+def _render(generator) -> tuple[bytes, str, float, float]:
+  # Время рисования и кодирования меряется в воркере и возвращается с картинкой
+  started = time.perf_counter()
+  img = generator.generate_calendar(output_path=None)
+  drawn = time.perf_counter()
+  format = generator.resolved_format()
+  data = generator.encode(img, format)
+  return data, format, drawn - started, time.perf_counter() - drawn
+
+class RenderExecutor:
+  """Выполняет отрисовку календарей вне event loop'а"""
+
+  def __init__(self, kind: str = 'process', max_workers: int | None = None, queue_size: int = 16, nice: int = 0):
+    self.kind = kind
+    self.max_workers = max_workers or os.cpu_count() or 1
+    self.queue_size = queue_size
+    # Насколько понизить приоритет воркеров относительно бота
+    self.nice = nice
+
+    # Одновременно в работе и в очереди не больше max_workers + queue_size задач,
+    # остальные ждут здесь, не нагружая пул
+    self._slots = asyncio.Semaphore(self.max_workers + self.queue_size)
+    self._executor: Executor | None = None
+
+  def _get_executor(self) -> Executor:
+    if self._executor is None:
+      initializer = {'initializer': _lower_priority, 'initargs': (self.nice,)} if self.nice else {}
+      if self.kind == 'thread':
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='calendar-render', **initializer)
+      else:
+        # spawn, а не fork: в процессе бота уже крутятся потоки aiohttp
+        self._executor = ProcessPoolExecutor(
+          self.max_workers, mp_context=multiprocessing.get_context('spawn'), **initializer
+        )
+    return self._executor
+
+  async def run(self, func, *args):
+    """Выполнить func(*args) в пуле; func и аргументы должны передаваться в процесс"""
+    async with self._slots:
+      loop = asyncio.get_running_loop()
+      return await loop.run_in_executor(self._get_executor(), func, *args)
+
+  async def render(self, generator) -> bytes:
+    started = time.perf_counter()
+    data, format, draw_seconds, encode_seconds = await self.run(_render, generator)
+
+    calendar_phase_seconds.labels(phase='render').observe(draw_seconds)
+    calendar_phase_seconds.labels(phase='encode').observe(encode_seconds)
+    calendar_image_bytes.labels(format=format).observe(len(data))
+    # Остальное — ожидание места в пуле и передача генератора и картинки между процессами
+    queued = time.perf_counter() - started - draw_seconds - encode_seconds
+    calendar_phase_seconds.labels(phase='queue').observe(max(queued, 0.0))
+    return data
+
+  def shutdown(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False, cancel_futures=True)
+      self._executor = None
+
+render_executor = RenderExecutor(
+  kind=settings.RENDER_EXECUTOR,
+  max_workers=settings.RENDER_WORKERS,
+  queue_size=settings.RENDER_QUEUE_SIZE
+)
+
+# Предварительная отрисовка соседних месяцев идёт в своём воркере с пониженным
+# приоритетом: она не занимает ни слоты, ни воркеры запросов пользователей
+prewarm_executor = RenderExecutor(
+  kind=settings.RENDER_EXECUTOR,
+  max_workers=1,
+  queue_size=4,
+  nice=10
+)
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+
+import asyncpg
+
+from config import settings
+from app.crud import INSTANCE_ID, ROSTER_CHANNEL, user_crud
+
+logger = logging.getLogger(__name__)
+
+
+class RosterListener:
+  """Принимает от других реплик уведомления об изменении профилей и сбрасывает
+  локальные кэши: пользователей, месяцев и (через версии состава) календарей
+  """
+
+  def __init__(self, reconnect_delay: float = 5):
+    self.reconnect_delay = reconnect_delay
+    self._task: asyncio.Task | None = None
+
+  def start(self):
+    self._task = asyncio.create_task(self._run())
+
+  async def stop(self):
+    if self._task is None:
+      return
+    self._task.cancel()
+    await asyncio.gather(self._task, return_exceptions=True)
+    self._task = None
+
+  def _on_notify(self, connection, pid, channel, payload: str):
+    try:
+      message = json.loads(payload)
+    except json.JSONDecodeError:
+      logger.warning('Некорректное уведомление %s: %s', channel, payload)
+      return
+
+    if message.get('origin') == INSTANCE_ID:
+      return
+
+    user_crud.apply_invalidation(
+      message.get('tg_id'),
+      set(message.get('months', ())),
+      message.get('roster_changed', False),
+      message.get('group_id')
+    )
+
+  async def _run(self):
+    while True:
+      connection = None
+      try:
+        connection = await asyncpg.connect(settings.DATABASE_DSN)
+        await connection.add_listener(ROSTER_CHANNEL, self._on_notify)
+        # Пока не было подписки, уведомления могли потеряться
+        user_crud.apply_invalidation(None, roster_changed=True)
+
+        closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: closed.set())
+        await closed.wait()
+        logger.warning('Соединение LISTEN %s закрыто, переподключаемся', ROSTER_CHANNEL)
+      except (OSError, asyncpg.PostgresError) as e:
+        logger.warning('Не удалось подписаться на %s: %s', ROSTER_CHANNEL, e)
+      finally:
+        if connection is not None and not connection.is_closed():
+          await connection.close()
+
+      await asyncio.sleep(self.reconnect_delay)
+
+roster_listener = RosterListener()
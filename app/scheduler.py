@@ -1,38 +1,255 @@
-from datetime import date, datetime
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from datetime import date, datetime, time, timedelta
 from aiogram import Bot
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.postgresql import insert
 import pytz
 
-from app.crud import user_crud
-from app.models import User
+from app.broadcast import broadcaster
+from app.birthdays import BirthdayEntry, birthday_summary, turning_age
+from app.crud import group_crud, user_crud
+from app.photo_store import photo_store
+from app.thumbnails import thumbnail_cache
+from app.models import JobRun
+from config import settings
 from database import async_session_factory
 
-async def send_birthday_notifications(bot: Bot):
+logger = logging.getLogger(__name__)
+
+async def claim_daily_run(job: str, run_date: date) -> datetime | None:
+  """Занять запуск задачи на дату; отметку аренды получит только одна из реплик.
+
+  Запуск, не отмеченный finish_daily_run и не продлённый renew_daily_run за
+  SCHEDULER_CLAIM_LEASE секунд (реплика упала или рассылка прервалась), можно
+  занять заново. Повторная рассылка начнётся сначала: лучше дубль, чем
+  потерянный день.
+  """
+  now = func.timezone('utc', func.now())
+  query = (
+    insert(JobRun)
+    .values(job=job, run_date=run_date)
+    .on_conflict_do_update(
+      index_elements=[JobRun.job, JobRun.run_date],
+      set_={'started_at': now},
+      where=(
+        JobRun.finished_at.is_(None)
+        & (JobRun.started_at < now - timedelta(seconds=settings.SCHEDULER_CLAIM_LEASE))
+      )
+    )
+    .returning(JobRun.started_at)
+  )
   async with async_session_factory() as session:
-    today = date.today()
-
-    users = await user_crud.get_all_users(session)
-    birthday_users: list[User] = []
-
-    for user in users:
-      user_birthday = user.birthday
-      if not user_birthday:
-        continue
-      
-      if user_birthday.month == today.month and user_birthday.day == today.day:
-        birthday_users.append(user)
-    
-    if birthday_users:
-      message_parts = ["🎉 Сегодня день рождения отмечают:\n"]
-      
-      for user in birthday_users:
-        age = today.year - user.birthday.year
-        message_parts.append(f'{user.birthday.day}.{user.birthday.month}.{user.birthday.year}: {user.name} - @{user.username} исполняется {(age+1)} ✨')
-      
-      notification_text = "\n".join(message_parts)
-      
-      all_users_to_notify = await user_crud.get_all_users(session)
-      for user_to_notify in all_users_to_notify:
+    lease = (await session.execute(query)).scalar_one_or_none()
+    await session.commit()
+
+  return lease
+
+async def renew_daily_run(job: str, run_date: date, lease: datetime) -> datetime | None:
+  """Продлить аренду запуска; None, если её уже перехватила другая реплика"""
+  query = (
+    update(JobRun)
+    .where(
+      JobRun.job == job,
+      JobRun.run_date == run_date,
+      JobRun.started_at == lease,
+      JobRun.finished_at.is_(None)
+    )
+    .values(started_at=func.timezone('utc', func.now()))
+    .returning(JobRun.started_at)
+  )
+  async with async_session_factory() as session:
+    lease = (await session.execute(query)).scalar_one_or_none()
+    await session.commit()
+
+  return lease
+
+async def finish_daily_run(job: str, run_date: date):
+  query = (
+    update(JobRun)
+    .where(JobRun.job == job, JobRun.run_date == run_date)
+    .values(finished_at=func.timezone('utc', func.now()))
+  )
+  # Дата запуска — местная дата пояса, разница между поясами меньше суток:
+  # отметки старше позавчерашних уже никто не займёт
+  prune = delete(JobRun).where(JobRun.run_date < run_date - timedelta(days=2))
+  async with async_session_factory() as session:
+    await session.execute(query)
+    await session.execute(prune)
+    await session.commit()
+
+def _bot() -> Bot:
+  # Бота берём там же, где его берут хендлеры: main импортирует этот модуль
+  from main import bot
+  return bot
+
+def _since_local_midnight(tz_name: str, now: datetime) -> tuple[date, timedelta] | None:
+  """Местная дата в поясе tz_name и сколько прошло с местной полуночи"""
+  try:
+    tz = pytz.timezone(tz_name)
+  except pytz.UnknownTimeZoneError:
+    logger.warning('Неизвестный часовой пояс %s', tz_name)
+    return None
+
+  local_now = now.astimezone(tz)
+  today = local_now.date()
+  return today, local_now - tz.localize(datetime.combine(today, time()))
+
+def _is_due(since_midnight: timedelta, offset: timedelta) -> bool:
+  return offset <= since_midnight < offset + timedelta(seconds=settings.SCHEDULER_MISFIRE_GRACE)
+
+async def send_birthday_notifications():
+  """Разослать поздравления в тех часовых поясах, где уже наступило время очередной части рассылки.
+
+  Запускается каждые NOTIFY_CHECK_INTERVAL минут. Часть shard пояса tz уходит
+  первым запуском после местной полуночи плюс её смещение в BROADCAST_WINDOW,
+  но не позже SCHEDULER_MISFIRE_GRACE — так пропущенные из-за простоя запуски
+  догоняются, а старые не отправляются. Группы получают одно сообщение в чат
+  сразу после своей полуночи.
+  """
+  now = datetime.now(pytz.utc)
+
+  async with async_session_factory() as session:
+    timezones = await user_crud.get_notify_timezones(session)
+    group_timezones = await group_crud.get_notify_timezones(session)
+
+  shards = max(settings.BROADCAST_SHARDS, 1)
+  for tz_name in timezones:
+    if (local := _since_local_midnight(tz_name, now)) is None:
+      continue
+
+    today, since_midnight = local
+    for shard in range(shards):
+      if _is_due(since_midnight, timedelta(minutes=settings.BROADCAST_WINDOW) * shard / shards):
+        # Сбой одного пояса не должен отменять остальные; его запуск перехватят после аренды
         try:
-          await bot.send_message(chat_id=user_to_notify.tg_id, text=notification_text)
-        except Exception as e:
-          print(f"Не удалось отправить сообщение пользователю {user_to_notify['tg_id']}: {e}")
\ No newline at end of file
+          await _notify_shard(tz_name, today, shard, shards)
+        except Exception:
+          logger.exception('Рассылка в поясе %s (часть %s) не удалась', tz_name, shard)
+
+  for tz_name in group_timezones:
+    if (local := _since_local_midnight(tz_name, now)) is None:
+      continue
+
+    today, since_midnight = local
+    if _is_due(since_midnight, timedelta()):
+      try:
+        await _notify_groups(tz_name, today)
+      except Exception:
+        logger.exception('Рассылка группам в поясе %s не удалась', tz_name)
+
+async def _notify_shard(tz_name: str, today: date, shard: int, shards: int):
+  job = f'birthday_notifications:{tz_name}' if shards == 1 else f'birthday_notifications:{tz_name}:{shard}'
+
+  if (lease := await claim_daily_run(job, today)) is None:
+    return
+
+  async with async_session_factory() as session:
+    entries = await birthday_summary.month_entries(session, today.month, today)
+  birthday_entries = [entry for entry in entries if entry.user.birthday.day == today.day]
+
+  if birthday_entries:
+    notification_text = birthday_summary.notification_text(birthday_entries)
+
+    chat_ids = _recipients(job, today, lease, tz_name, shards, shard)
+    result = await broadcaster.send(_bot(), chat_ids, notification_text)
+
+    async with async_session_factory() as session:
+      await user_crud.mark_blocked(session, result.blocked)
+      await session.commit()
+
+  await finish_daily_run(job, today)
+
+async def _recipients(
+  job: str,
+  run_date: date,
+  lease: datetime,
+  tz_name: str,
+  shards: int,
+  shard: int
+) -> AsyncIterator[list[str]]:
+  """Получатели части порциями; на время отправки соединение с БД не держим.
+
+  Перед каждой следующей порцией аренда запуска продлевается: часть рассылки
+  может идти дольше SCHEDULER_CLAIM_LEASE, и без этого её заняла бы заново
+  другая реплика.
+  """
+  last_tg_id = ''
+  while True:
+    if last_tg_id:
+      lease = await renew_daily_run(job, run_date, lease)
+      if lease is None:
+        raise RuntimeError(f'Запуск {job} за {run_date} занят другой репликой')
+
+    async with async_session_factory() as session:
+      chunk = await user_crud.get_chat_ids_to_notify(
+        session, settings.BROADCAST_CHUNK_SIZE, last_tg_id, shards, shard, tz_name
+      )
+    if not chunk:
+      return
+
+    yield chunk
+    last_tg_id = chunk[-1]
+
+async def _notify_groups(tz_name: str, today: date):
+  job = f'group_notifications:{tz_name}'
+  if await claim_daily_run(job, today) is None:
+    return
+
+  async with async_session_factory() as session:
+    birthdays = await group_crud.get_birthdays_on(session, tz_name, today.month, today.day)
+
+  messages = [
+    (group_id, birthday_summary.notification_text([
+      BirthdayEntry(user=user, turning=turning_age(user.birthday, today)) for user in users
+    ]))
+    for group_id, users in birthdays.items()
+  ]
+  if messages:
+    result = await broadcaster.send_messages(_bot(), messages)
+
+    async with async_session_factory() as session:
+      await group_crud.mark_blocked(session, result.blocked)
+      await session.commit()
+
+  await finish_daily_run(job, today)
+
+async def cleanup_photo_store():
+  async with async_session_factory() as session:
+    photo_ids = await user_crud.get_photo_ids(session)
+
+  await asyncio.to_thread(photo_store.prune, photo_ids)
+  await asyncio.to_thread(thumbnail_cache.prune, photo_store.hashes() | {'None'})
+
+
+async def sync_installed_photos(bot: Bot):
+  """Докачать фото, обновлённые после последней загрузки, и отметить installed_at пачками"""
+  semaphore = asyncio.Semaphore(settings.PREFETCH_WORKERS)
+
+  async def fetch(photo_id: str):
+    async with semaphore:
+      return await photo_store.fetch(bot, photo_id) is not None
+
+  last_tg_id = ''
+  synced = 0
+  while True:
+    async with async_session_factory() as session:
+      batch = await user_crud.get_stale_photos(session, settings.PHOTO_SYNC_BATCH_SIZE, last_tg_id)
+    if not batch:
+      break
+
+    # Пока качаем, соединение с БД не держим
+    results = await asyncio.gather(*(fetch(photo_id) for _, photo_id in batch))
+    installed = [photo for photo, ok in zip(batch, results) if ok]
+
+    # Заодно сбрасывает календари месяцев этих пользователей на всех репликах
+    async with async_session_factory() as session:
+      await user_crud.mark_photos_installed(session, installed)
+      await session.commit()
+
+    synced += len(installed)
+    last_tg_id = batch[-1][0]
+
+  if synced:
+    logger.info('Синхронизировано фото: %s', synced)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+  """Кэш уже уменьшенных под клетку календаря RGBA-плиток.
+
+  Держит последние max_items плиток в памяти и, если задан disk_dir, сохраняет
+  их на диск, чтобы другие процессы пула отрисовки не декодировали фото заново.
+  """
+
+  def __init__(self, max_items: int = 256, disk_dir: str | None = None):
+    self.max_items = max_items
+    self.disk_dir = disk_dir
+    self._tiles: OrderedDict[tuple[str, int], Image.Image] = OrderedDict()
+    # Пул отрисовки может работать на потоках
+    self._lock = threading.Lock()
+
+    if disk_dir:
+      os.makedirs(disk_dir, exist_ok=True)
+
+  def _disk_path(self, image_path: str, size: int) -> str:
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(self.disk_dir, f'{stem}_{size}.png')
+
+  def _load(self, image_path: str, size: int) -> Image.Image:
+    disk_path = self._disk_path(image_path, size) if self.disk_dir else None
+
+    if disk_path and os.path.exists(disk_path) and os.path.getmtime(disk_path) >= os.path.getmtime(image_path):
+      with Image.open(disk_path) as tile:
+        return tile.convert('RGBA')
+
+    with Image.open(image_path) as source:
+      tile = source.convert('RGBA').resize((size, size), Image.Resampling.LANCZOS)
+
+    if disk_path:
+      try:
+        # Уникальное имя: плитку могут одновременно сохранять несколько процессов пула
+        tmp_path = f'{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        tile.save(tmp_path, format='PNG')
+        os.replace(tmp_path, disk_path)
+      except OSError as e:
+        logger.warning('Не удалось сохранить миниатюру %s: %s', disk_path, e)
+
+    return tile
+
+  def get(self, image_path: str, size: int) -> Image.Image:
+    key = (image_path, size)
+    with self._lock:
+      tile = self._tiles.get(key)
+      if tile is not None:
+        self._tiles.move_to_end(key)
+        return tile
+
+    tile = self._load(image_path, size)
+    with self._lock:
+      self._tiles[key] = tile
+      while len(self._tiles) > self.max_items:
+        self._tiles.popitem(last=False)
+
+    return tile
+
+  def prune(self, source_stems: set[str]):
+    """Удалить с диска миниатюры фото, которых больше нет"""
+    if not self.disk_dir:
+      return
+
+    for entry in os.scandir(self.disk_dir):
+      stem = entry.name.rsplit('_', 1)[0]
+      if entry.is_file() and stem not in source_stems:
+        os.remove(entry.path)
+
+thumbnail_cache = ThumbnailCache(
+  max_items=settings.THUMBNAIL_CACHE_SIZE,
+  disk_dir=settings.THUMBNAIL_DIR or None
+)
@@ -0,0 +1,205 @@
+"""Рассылка через Broadcaster и send_birthday_notifications против локального подобия Telegram.
+
+    python -m benchmarks.broadcast [--sizes 500 2000] [--latency 0.05] [--server-limit 30] [--skip-db]
+
+Фейковый Bot API на aiohttp отвечает на sendMessage с задержкой, возвращает 429
+при превышении server-limit сообщений в секунду (и случайно с вероятностью
+flood-rate), 403 — для доли blocked-share чатов. Замер send_birthday_notifications
+заполняет базу {DB_NAME}_bench пользователями пояса, где только что наступила полночь.
+"""
+import argparse
+import asyncio
+import collections
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from benchmarks.common import ensure_database, reset_schema, seed, run, write_results
+
+from config import settings
+from app.broadcast import Broadcaster
+from database import engine
+
+
+class FakeTelegram:
+  """Минимальный Bot API: только sendMessage, с лимитом частоты и блокировками"""
+
+  def __init__(self, latency: float, jitter: float, rate_limit: int, retry_after: int, flood_rate: float, blocked_share: float):
+    self.latency = latency
+    self.jitter = jitter
+    self.rate_limit = rate_limit
+    self.retry_after = retry_after
+    self.flood_rate = flood_rate
+    self.blocked_share = blocked_share
+
+    self.rng = random.Random(0)
+    self.counters = collections.Counter()
+    self._window: collections.deque[float] = collections.deque()
+    self._runner: web.AppRunner | None = None
+
+  def reset(self):
+    self.counters.clear()
+    self._window.clear()
+
+  async def start(self) -> str:
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', self._handle)
+    self._runner = web.AppRunner(app, access_log=None)
+    await self._runner.setup()
+    site = web.TCPSite(self._runner, '127.0.0.1', 0)
+    await site.start()
+    port = self._runner.addresses[0][1]
+    return f'http://127.0.0.1:{port}'
+
+  async def stop(self):
+    await self._runner.cleanup()
+
+  async def _handle(self, request: web.Request) -> web.Response:
+    data = await request.post()
+    chat_id = int(data.get('chat_id', 0))
+    self.counters['requests'] += 1
+
+    await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+
+    # Скользящее окно в одну секунду, как общий лимит бота в Telegram
+    now = time.monotonic()
+    while self._window and now - self._window[0] > 1:
+      self._window.popleft()
+
+    if len(self._window) >= self.rate_limit or self.rng.random() < self.flood_rate:
+      self.counters['429'] += 1
+      return web.json_response({
+        'ok': False,
+        'error_code': 429,
+        'description': f'Too Many Requests: retry after {self.retry_after}',
+        'parameters': {'retry_after': self.retry_after},
+      }, status=429)
+    self._window.append(now)
+
+    if abs(chat_id) % 1000 < self.blocked_share * 1000:
+      self.counters['403'] += 1
+      return web.json_response({'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}, status=403)
+
+    self.counters['ok'] += 1
+    return web.json_response({
+      'ok': True,
+      'result': {
+        'message_id': self.counters['ok'],
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'text': data.get('text', ''),
+      },
+    })
+
+
+def _midnight_timezone() -> str:
+  """Пояс Etc/GMT±N, где местное время сейчас между 00:00 и 01:00"""
+  offset = -datetime.now(pytz.utc).hour % 24
+  if offset > 14:
+    offset -= 24
+  # В именах Etc/GMT знак инвертирован: Etc/GMT-3 — это UTC+3
+  return f'Etc/GMT{"-" if offset > 0 else "+"}{abs(offset)}'
+
+def _broadcaster(args) -> Broadcaster:
+  return Broadcaster(rate=args.rate, workers=args.workers, max_retries=args.max_retries)
+
+async def _bench_broadcaster(bot: Bot, server: FakeTelegram, users: int, args) -> dict:
+  server.reset()
+  chat_ids = [str(10_000_000 + index) for index in range(users)]
+
+  started = time.perf_counter()
+  result = await _broadcaster(args).send(bot, chat_ids, 'benchmark')
+  elapsed = time.perf_counter() - started
+
+  return {
+    'seconds': round(elapsed, 3),
+    'messages_per_second': round(result.sent / elapsed, 2),
+    'sent': result.sent,
+    'failed': result.failed,
+    'blocked': len(result.blocked),
+    'server': dict(server.counters),
+  }
+
+async def _bench_notifications(bot: Bot, server: FakeTelegram, users: int, args) -> dict:
+  import app.scheduler as scheduler
+
+  tz = _midnight_timezone()
+  today = datetime.now(pytz.timezone(tz)).date()
+
+  await reset_schema()
+  await seed(users, timezones=[tz], birthdays_on=today, birthdays_on_share=0.01)
+
+  # Бот и рассылка бенчмарка вместо тех, что берутся из main и настроек
+  scheduler._bot = lambda: bot
+  scheduler.broadcaster = _broadcaster(args)
+  settings.SCHEDULER_MISFIRE_GRACE = int(timedelta(hours=2).total_seconds())
+
+  server.reset()
+  started = time.perf_counter()
+  await scheduler.send_birthday_notifications()
+  elapsed = time.perf_counter() - started
+
+  return {
+    'timezone': tz,
+    'seconds': round(elapsed, 3),
+    'messages_per_second': round(server.counters['ok'] / elapsed, 2) if elapsed else None,
+    'server': dict(server.counters),
+  }
+
+async def _main(args) -> dict:
+  server = FakeTelegram(
+    latency=args.latency,
+    jitter=args.latency / 4,
+    rate_limit=args.server_limit,
+    retry_after=args.retry_after,
+    flood_rate=args.flood_rate,
+    blocked_share=args.blocked_share,
+  )
+  url = await server.start()
+  bot = Bot('123456:benchmark', session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+
+  results = {'broadcaster': {}, 'send_birthday_notifications': {}}
+  try:
+    for users in args.sizes:
+      results['broadcaster'][str(users)] = stats = await _bench_broadcaster(bot, server, users, args)
+      print(f'Broadcaster, {users} чатов: {stats["seconds"]} с, {stats["messages_per_second"]} сообщ./с, {stats["server"]}')
+
+    if not args.skip_db:
+      await ensure_database()
+      for users in args.sizes:
+        results['send_birthday_notifications'][str(users)] = stats = await _bench_notifications(bot, server, users, args)
+        print(f'send_birthday_notifications, {users} пользователей: {stats["seconds"]} с, {stats["server"]}')
+  finally:
+    await bot.session.close()
+    await server.stop()
+    await engine.dispose()
+
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000])
+  parser.add_argument('--latency', type=float, default=0.05, help='средняя задержка ответа, с')
+  parser.add_argument('--server-limit', type=int, default=30, help='сообщений в секунду до 429')
+  parser.add_argument('--retry-after', type=int, default=1)
+  parser.add_argument('--flood-rate', type=float, default=0.001, help='доля случайных 429')
+  parser.add_argument('--blocked-share', type=float, default=0.02)
+  parser.add_argument('--rate', type=float, default=settings.BROADCAST_RATE)
+  parser.add_argument('--workers', type=int, default=settings.BROADCAST_WORKERS)
+  parser.add_argument('--max-retries', type=int, default=settings.BROADCAST_MAX_RETRIES)
+  parser.add_argument('--skip-db', action='store_true', help='только Broadcaster, без базы')
+  parser.add_argument('--output')
+  args = parser.parse_args()
+
+  results = run(_main(args))
+  results['parameters'] = {key: value for key, value in vars(args).items() if key != 'output'}
+  write_results('broadcast', results, args.output)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,204 @@
+"""Общее для бенчмарков: отдельная база, временные каталоги, замеры и запись JSON.
+
+Импортировать раньше модулей приложения: модуль переключает настройки на базу
+{DB_NAME}_bench и временные каталоги фото, чтобы замеры не трогали данные бота.
+Переменные окружения наследуют и процессы пула отрисовки.
+"""
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+from PIL import Image
+
+from config import settings
+
+SOURCE_DB = settings.DB_NAME
+BENCH_DB = f'{SOURCE_DB}_bench'
+TMP_DIR = tempfile.mkdtemp(prefix='birthdays-bench-')
+
+_overrides = {
+  'DB_NAME': BENCH_DB,
+  'PHOTO_STORE_DIR': os.path.join(TMP_DIR, 'store'),
+  'THUMBNAIL_DIR': os.path.join(TMP_DIR, 'thumbs'),
+  'ROSTER_NOTIFY': 'false',
+}
+for key, value in _overrides.items():
+  os.environ[key] = value
+  setattr(settings, key, False if value == 'false' else value)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+TIMEZONES = ['Europe/Moscow', 'Europe/Kaliningrad', 'Asia/Yekaterinburg', 'Asia/Novosibirsk', 'Asia/Vladivostok']
+
+
+def summarize(samples: list[float]) -> dict:
+  """Статистика по замерам в миллисекундах"""
+  ms = sorted(sample * 1000 for sample in samples)
+  return {
+    'runs': len(ms),
+    'min_ms': round(ms[0], 3),
+    'median_ms': round(statistics.median(ms), 3),
+    'mean_ms': round(statistics.fmean(ms), 3),
+    'p95_ms': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+    'max_ms': round(ms[-1], 3),
+  }
+
+def measure(func, repeat: int, setup=None) -> dict:
+  samples = []
+  for _ in range(repeat):
+    if setup:
+      setup()
+    started = time.perf_counter()
+    func()
+    samples.append(time.perf_counter() - started)
+  return summarize(samples)
+
+async def measure_async(func, repeat: int, setup=None) -> dict:
+  samples = []
+  for _ in range(repeat):
+    if setup:
+      setup()
+    started = time.perf_counter()
+    await func()
+    samples.append(time.perf_counter() - started)
+  return summarize(samples)
+
+
+def _git_commit() -> str | None:
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def write_results(name: str, results: dict, output: str | None = None) -> str:
+  output = output or os.path.join(RESULTS_DIR, f'{name}.json')
+  os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+  report = {
+    'benchmark': name,
+    'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    'commit': _git_commit(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'results': results,
+  }
+  with open(output, 'w', encoding='utf-8') as f:
+    json.dump(report, f, ensure_ascii=False, indent=2)
+
+  print(f'Результаты: {output}')
+  return output
+
+
+def make_photos(count: int, size: int = 640, seed: int = 0) -> list[bytes]:
+  """Синтетические JPEG-аватарки разного цвета"""
+  rng = random.Random(seed)
+  photos = []
+  for _ in range(count):
+    color = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new('RGB', (size, size), color)
+    img.paste(tuple(255 - c for c in color), (size // 4, size // 4, size * 3 // 4, size * 3 // 4))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    photos.append(buffer.getvalue())
+  return photos
+
+
+async def ensure_database():
+  """Создать базу бенчмарков рядом с основной, если её ещё нет"""
+  import asyncpg
+
+  connection = await asyncpg.connect(
+    host=settings.DB_HOST, port=settings.DB_PORT,
+    user=settings.DB_USER, password=settings.DB_PASS, database=SOURCE_DB
+  )
+  try:
+    exists = await connection.fetchval('SELECT 1 FROM pg_database WHERE datname = $1', BENCH_DB)
+    if not exists:
+      await connection.execute(f'CREATE DATABASE "{BENCH_DB}"')
+  finally:
+    await connection.close()
+
+async def reset_schema():
+  from database import Base, engine
+  import app.models  # noqa: F401 — регистрирует таблицы в Base.metadata
+
+  async with engine.begin() as connection:
+    await connection.run_sync(Base.metadata.drop_all)
+    await connection.run_sync(Base.metadata.create_all)
+
+async def seed(
+  users: int,
+  group_size: int = 30,
+  group_share: float = 0.5,
+  photo_ids: list[str] = (),
+  timezones: list[str] = TIMEZONES,
+  birthdays_on: date | None = None,
+  birthdays_on_share: float = 0.001,
+  seed: int = 0
+):
+  """Заполнить пустую схему пользователями, группами и членством.
+
+  В группах по group_size человек состоит доля group_share пользователей.
+
+  birthdays_on — дата, на которую приходится доля birthdays_on_share дней рождения
+  (для замеров рассылки); у остальных дата случайная.
+  """
+  from sqlalchemy import insert, text
+
+  from app.crud import user_crud
+  from app.models import Group, Membership
+  from database import async_session_factory
+
+  rng = random.Random(seed)
+  rows = []
+  for index in range(users):
+    if birthdays_on and rng.random() < birthdays_on_share:
+      birthday = birthdays_on.replace(year=rng.randrange(1990, 2006))
+    else:
+      birthday = date(rng.randrange(1990, 2006), rng.randrange(1, 13), rng.randrange(1, 29))
+
+    rows.append({
+      'tg_id': str(10_000_000 + index),
+      'username': f'user{index}',
+      'name': f'Пользователь {index}',
+      'birthday': birthday,
+      'photo_id': rng.choice(photo_ids) if photo_ids and rng.random() < 0.7 else None,
+      'timezone': rng.choice(timezones),
+    })
+
+  members = rows[:int(users * group_share)]
+  groups = [
+    {'chat_id': str(-1_000_000 - index), 'title': f'Группа {index}', 'timezone': rng.choice(timezones)}
+    for index in range(max(1, -(-len(members) // group_size)))
+  ]
+  memberships = [
+    {'group_id': groups[index // group_size]['chat_id'], 'user_id': row['tg_id']}
+    for index, row in enumerate(members)
+  ]
+
+  async with async_session_factory() as session:
+    await user_crud.bulk_upsert_users(session, rows)
+    for start in range(0, len(groups), 1000):
+      await session.execute(insert(Group), groups[start:start + 1000])
+    for start in range(0, len(memberships), 5000):
+      await session.execute(insert(Membership), memberships[start:start + 5000])
+    await session.commit()
+
+    # Статистика планировщика, как на живой базе после autovacuum
+    await session.execute(text('ANALYZE'))
+    await session.commit()
+
+  return rows, groups
+
+
+def run(coro):
+  return asyncio.run(coro)
@@ -0,0 +1,56 @@
+"""Сравнение двух отчётов бенчмарка: медианы и длительности, выросшие больше порога.
+
+    python -m benchmarks.compare baseline.json current.json [--threshold 0.2]
+
+Код возврата 1, если есть регрессии, — удобно для проверки перед деплоем.
+"""
+import argparse
+import json
+import sys
+
+# Метрики, по которым считается регрессия: больше — хуже
+METRICS = ('median_ms', 'seconds')
+
+
+def _flatten(node, prefix: str = ''):
+  if isinstance(node, dict):
+    for key, value in node.items():
+      yield from _flatten(value, f'{prefix}.{key}' if prefix else key)
+  elif isinstance(node, (int, float)) and prefix.rsplit('.', 1)[-1] in METRICS:
+    yield prefix, node
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[tuple[str, float, float]]:
+  before = dict(_flatten(baseline['results']))
+  after = dict(_flatten(current['results']))
+
+  regressions = []
+  for name, old in before.items():
+    new = after.get(name)
+    if new is None or old <= 0:
+      continue
+    if new > old * (1 + threshold):
+      regressions.append((name, old, new))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('baseline')
+  parser.add_argument('current')
+  parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост, доля')
+  args = parser.parse_args()
+
+  with open(args.baseline, encoding='utf-8') as f:
+    baseline = json.load(f)
+  with open(args.current, encoding='utf-8') as f:
+    current = json.load(f)
+
+  regressions = compare(baseline, current, args.threshold)
+  for name, old, new in regressions:
+    print(f'{name}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)')
+
+  if regressions:
+    sys.exit(1)
+  print('Регрессий нет')
+
+if __name__ == '__main__':
+  main()
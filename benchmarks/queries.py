@@ -0,0 +1,126 @@
+"""Запросы UserCRUD/GroupCRUD и generate_calendar_with_photos на заполненной базе.
+
+    python -m benchmarks.queries [--sizes 1000 10000 100000] [--repeat 20] [--output path.json]
+
+Нужен Postgres из настроек бота: рядом создаётся база {DB_NAME}_bench, схема
+в ней пересоздаётся для каждого размера. Кэши приложения сбрасываются перед
+каждым замером, кроме явно тёплых.
+"""
+import argparse
+import random
+
+from benchmarks.common import ensure_database, make_photos, measure_async, reset_schema, run, seed, write_results
+
+from app.birthdays import birthday_summary
+from app.crud import group_crud, user_crud
+from app.drawing import generate_calendar_with_photos
+from app.photo_store import photo_store
+from app.render_pool import render_executor
+from database import async_session_factory, engine
+
+PHOTOS = 20
+
+
+def _drop_caches():
+  user_crud.cache.clear()
+  birthday_summary._entries.clear()
+
+async def _bench_size(users: int, repeat: int) -> dict:
+  await reset_schema()
+
+  photo_ids = [f'bench-photo-{index}' for index in range(PHOTOS)]
+  for photo_id, data in zip(photo_ids, make_photos(PHOTOS)):
+    photo_store.put(photo_id, data)
+
+  rows, groups = await seed(users, photo_ids=photo_ids)
+  rng = random.Random(1)
+
+  async def in_session(func):
+    async with async_session_factory() as session:
+      return await func(session)
+
+  async def get_user():
+    await in_session(lambda session: user_crud.get_user(session, int(rng.choice(rows)['tg_id'])))
+
+  async def month():
+    await in_session(lambda session: user_crud.get_users_born_in_month(session, rng.randrange(1, 13)))
+
+  async def cached_month():
+    await in_session(lambda session: user_crud.get_users_born_in_month(session, 10))
+
+  async def group_month():
+    await in_session(lambda session: user_crud.get_users_born_in_month(session, rng.randrange(1, 13), rng.choice(groups)['chat_id']))
+
+  async def drain_recipients(**filters):
+    # Как рассылка: каждая порция в своей сессии
+    count, last_tg_id = 0, ''
+    while True:
+      async with async_session_factory() as session:
+        chunk = await user_crud.get_chat_ids_to_notify(session, 1000, last_tg_id, **filters)
+      if not chunk:
+        return count
+      count += len(chunk)
+      last_tg_id = chunk[-1]
+
+  async def group_birthdays():
+    await in_session(lambda session: group_crud.get_birthdays_on(session, 'Europe/Moscow', rng.randrange(1, 13), rng.randrange(1, 29)))
+
+  async def stale_photos():
+    await in_session(lambda session: user_crud.get_stale_photos(session, 200))
+
+  async def calendar():
+    await generate_calendar_with_photos(2026, rng.randrange(1, 13))
+
+  async def group_calendar():
+    await generate_calendar_with_photos(2026, rng.randrange(1, 13), rng.choice(groups)['chat_id'])
+
+  # Пул отрисовки поднимается лениво, его запуск в замеры не входит
+  await calendar()
+  _drop_caches()
+  await cached_month()
+
+  results = {
+    'get_user': await measure_async(get_user, repeat, setup=_drop_caches),
+    'get_users_born_in_month': await measure_async(month, repeat, setup=_drop_caches),
+    'get_users_born_in_month_cached': await measure_async(cached_month, repeat),
+    'get_users_born_in_month_group': await measure_async(group_month, repeat, setup=_drop_caches),
+    'get_notify_timezones': await measure_async(lambda: in_session(user_crud.get_notify_timezones), repeat),
+    'get_chat_ids_to_notify': await measure_async(drain_recipients, max(1, repeat // 4)),
+    'get_chat_ids_to_notify_tz_shard': await measure_async(
+      lambda: drain_recipients(shards=4, shard=0, tz='Europe/Moscow'), max(1, repeat // 4)
+    ),
+    'group_get_birthdays_on': await measure_async(group_birthdays, repeat),
+    'get_stale_photos': await measure_async(stale_photos, repeat),
+    'generate_calendar_with_photos': await measure_async(calendar, repeat, setup=_drop_caches),
+    'generate_calendar_with_photos_group': await measure_async(group_calendar, repeat, setup=_drop_caches),
+  }
+  # Личная рассылка идёт только тем, кто не состоит в группах
+  results['recipients'] = await drain_recipients()
+  return results
+
+async def _main(sizes: list[int], repeat: int) -> dict:
+  await ensure_database()
+  try:
+    results = {}
+    for users in sizes:
+      results[str(users)] = await _bench_size(users, repeat)
+      print(f'{users} пользователей:')
+      for name, stats in results[str(users)].items():
+        if isinstance(stats, dict):
+          print(f'  {name}: {stats["median_ms"]} мс')
+    return results
+  finally:
+    render_executor.shutdown()
+    await engine.dispose()
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--output')
+  args = parser.parse_args()
+
+  write_results('queries', run(_main(args.sizes, args.repeat)), args.output)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""Время отрисовки CalendarGenerator в зависимости от плотности дней рождения и размера клетки.
+
+    python -m benchmarks.render [--repeat 20] [--quality 85] [--output path.json]
+
+Холодный замер — без шаблонов и миниатюр в кэшах, тёплый — повторная отрисовка
+того же месяца, как при листании календаря. Для каждого формата из OUTPUT_FORMATS
+меряется время кодирования готовой картинки и её размер.
+"""
+import argparse
+import os
+import shutil
+
+from benchmarks.common import TMP_DIR, make_photos, measure, write_results
+
+from config import settings
+
+from app import drawing
+from app.drawing import FONT_PATH, OUTPUT_FORMATS, CalendarGenerator, encode_image
+from app.thumbnails import thumbnail_cache
+
+DENSITIES = [0, 5, 15, 31]
+CELL_SIZES = [80, 120, 160]
+
+
+def _photo_paths(count: int) -> list[str]:
+  directory = os.path.join(TMP_DIR, 'photos')
+  os.makedirs(directory, exist_ok=True)
+
+  paths = []
+  for index, data in enumerate(make_photos(count)):
+    path = os.path.join(directory, f'photo{index}.jpg')
+    with open(path, 'wb') as f:
+      f.write(data)
+    paths.append(path)
+  return paths
+
+def _generator(cell_size: int, density: int, photos: list[str]) -> CalendarGenerator:
+  # Январь: 31 день, при плотности 31 фото стоит в каждой клетке
+  generator = CalendarGenerator(year=2026, month=1, cell_size=cell_size, padding=20, font_path=FONT_PATH)
+  for day in range(1, density + 1):
+    generator.add_image_replacement(day, photos[day % len(photos)])
+  return generator
+
+def _drop_caches():
+  drawing._template_cache.clear()
+  with thumbnail_cache._lock:
+    thumbnail_cache._tiles.clear()
+  if thumbnail_cache.disk_dir:
+    shutil.rmtree(thumbnail_cache.disk_dir, ignore_errors=True)
+    os.makedirs(thumbnail_cache.disk_dir, exist_ok=True)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--quality', type=int, default=settings.CALENDAR_QUALITY, help='качество jpeg и webp')
+  parser.add_argument('--output')
+  args = parser.parse_args()
+
+  photos = _photo_paths(31)
+  # Ключ cell_size/density, чтобы compare сопоставлял замеры по параметрам
+  results = {}
+  for cell_size in CELL_SIZES:
+    for density in DENSITIES:
+      generator = _generator(cell_size, density, photos)
+
+      cold = measure(lambda: generator.generate_calendar(output_path=None), args.repeat, setup=_drop_caches)
+      warm = measure(lambda: generator.generate_calendar(output_path=None), args.repeat)
+
+      img = generator.generate_calendar(output_path=None)
+      encode = {}
+      for format in OUTPUT_FORMATS:
+        encode[format] = measure(lambda: encode_image(img, format, args.quality), args.repeat)
+        encode[format]['bytes'] = len(encode_image(img, format, args.quality))
+
+      results[f'{cell_size}/{density}'] = {
+        'cold': cold,
+        'warm': warm,
+        'encode': encode,
+      }
+      formats = ', '.join(f'{format} {stats["median_ms"]} мс / {stats["bytes"] // 1024} КБ' for format, stats in encode.items())
+      print(f'cell={cell_size} density={density}: cold {cold["median_ms"]} мс, warm {warm["median_ms"]} мс; {formats}')
+
+  write_results('render', results, args.output)
+
+if __name__ == '__main__':
+  main()
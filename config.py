@@ -1,17 +1,99 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
   BOT_API_KEY: str
 
+  # polling — long polling, webhook — aiohttp-сервер на WEB_HOST:WEB_PORT
+  BOT_MODE: Literal['polling', 'webhook'] = 'polling'
+  WEBHOOK_BASE_URL: str | None = None
+  WEBHOOK_PATH: str = '/webhook'
+  WEBHOOK_SECRET: str | None = None
+  WEB_HOST: str = '0.0.0.0'
+  WEB_PORT: int = 8000
+
+  # Метрики Prometheus и /debug/profile — отдельный сервер, по умолчанию доступный
+  # только локально; для сбора из соседнего контейнера METRICS_HOST=0.0.0.0
+  # без публикации порта наружу
+  METRICS_ENABLED: bool = True
+  METRICS_HOST: str = '127.0.0.1'
+  METRICS_PORT: int = 9100
+  METRICS_PATH: str = '/metrics'
+  # Токен для /debug/profile (cProfile или pyinstrument по запросу); без него маршрута нет
+  PROFILE_TOKEN: str | None = None
+
+  # postgres — состояние анкеты общее для всех реплик
+  FSM_STORAGE: Literal['memory', 'postgres'] = 'memory'
+  # Рассылать другим репликам сброс кэшей профилей через LISTEN/NOTIFY
+  ROSTER_NOTIFY: bool = False
+
   DB_HOST: str
   DB_PORT: int
   DB_USER: str
   DB_PASS: str
   DB_NAME: str
 
+  DB_POOL_SIZE: int = 5
+  DB_MAX_OVERFLOW: int = 10
+  DB_POOL_TIMEOUT: float = 30
+  DB_POOL_RECYCLE: int = 1800
+  DB_POOL_PRE_PING: bool = True
+  # Кэши подготовленных запросов asyncpg; 0 отключает их (нужно за pgbouncer в режиме transaction)
+  DB_STATEMENT_CACHE_SIZE: int = 100
+  DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+  DB_POOL_SLOW_WAIT: float = 0.1
+  DB_POOL_LOG_INTERVAL: int = 60
+
+  RENDER_EXECUTOR: Literal['process', 'thread'] = 'process'
+  RENDER_WORKERS: int | None = None
+  RENDER_QUEUE_SIZE: int = 16
+  # Формат отправляемых календарей: auto — PNG с палитрой для месяцев без фото
+  # и CALENDAR_PHOTO_FORMAT для остальных; Telegram всё равно пережимает фото в JPEG
+  CALENDAR_FORMAT: Literal['auto', 'png', 'palette', 'jpeg', 'webp'] = 'auto'
+  CALENDAR_PHOTO_FORMAT: Literal['png', 'jpeg', 'webp'] = 'jpeg'
+  CALENDAR_QUALITY: int = 85
+  # Сколько следующих месяцев (и один предыдущий) отрисовывать заранее; 0 — отключить
+  CALENDAR_PREWARM_MONTHS: int = 2
+
+  # Telegram допускает ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+  BROADCAST_RATE: float = 25
+  BROADCAST_WORKERS: int = 16
+  BROADCAST_MAX_RETRIES: int = 3
+  BROADCAST_CHUNK_SIZE: int = 1000
+  # Рассылка делится на BROADCAST_SHARDS частей, равномерно разнесённых по
+  # BROADCAST_WINDOW минутам после местной полуночи (меньше суток); 0 — все сразу
+  BROADCAST_SHARDS: int = 1
+  BROADCAST_WINDOW: int = 0
+  # Как часто (в минутах, делитель 60) проверять, в каких поясах наступила полночь
+  NOTIFY_CHECK_INTERVAL: int = 15
+
+  # Сколько секунд после пропущенного срока (рестарт, простой) задачу ещё можно выполнить
+  SCHEDULER_MISFIRE_GRACE: int = 3600
+  # Через сколько секунд без продления незавершённую рассылку (реплика упала посреди
+  # неё) можно начать заново; меньше SCHEDULER_MISFIRE_GRACE. Идущая рассылка продлевает
+  # аренду перед каждой порцией из BROADCAST_CHUNK_SIZE получателей
+  SCHEDULER_CLAIM_LEASE: int = 1800
+
+  PHOTO_STORE_DIR: str = './app/images/store'
+  PHOTO_STORE_MAX_MB: int = 200
+  PREFETCH_WORKERS: int = 4
+  PHOTO_SYNC_INTERVAL: int = 300
+  PHOTO_SYNC_BATCH_SIZE: int = 200
+
+  THUMBNAIL_CACHE_SIZE: int = 256
+  THUMBNAIL_DIR: str | None = './app/images/thumbs'
+
+  ROSTER_CACHE_TTL: int = 300
+
   @property
   def DATABASE_URL(self):
     return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
+  @property
+  def DATABASE_DSN(self):
+    # Для прямого подключения asyncpg (LISTEN) без SQLAlchemy
+    return f"postgresql://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
   
   model_config = SettingsConfigDict(env_file='.env')
 
@@ -1,13 +1,67 @@
+import logging
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from config import settings
 
+logger = logging.getLogger(__name__)
+
+class PoolMetrics:
+  def __init__(self):
+    self.checkouts = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+    self.slow_waits = 0
+
+  def record_wait(self, seconds: float):
+    self.checkouts += 1
+    self.total_wait += seconds
+    self.max_wait = max(self.max_wait, seconds)
+
+    if seconds >= settings.DB_POOL_SLOW_WAIT:
+      self.slow_waits += 1
+      logger.warning('Ожидание соединения из пула %.3f с (%s)', seconds, engine.pool.status())
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+  """Пул, замеряющий время ожидания свободного соединения"""
+
+  def _do_get(self):
+    started = time.perf_counter()
+    try:
+      return super()._do_get()
+    finally:
+      pool_metrics.record_wait(time.perf_counter() - started)
+
 engine = create_async_engine(
   settings.DATABASE_URL,
+  poolclass=InstrumentedPool,
+  pool_size=settings.DB_POOL_SIZE,
+  max_overflow=settings.DB_MAX_OVERFLOW,
+  pool_timeout=settings.DB_POOL_TIMEOUT,
+  pool_recycle=settings.DB_POOL_RECYCLE,
+  pool_pre_ping=settings.DB_POOL_PRE_PING,
+  connect_args={
+    'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+    'prepared_statement_cache_size': settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+  },
   # echo=True
 )
 
+def log_pool_status():
+  pool = engine.pool
+  average_wait = pool_metrics.total_wait / pool_metrics.checkouts if pool_metrics.checkouts else 0
+
+  logger.info(
+    'Пул БД: занято %s из %s (+%s сверх лимита), выдач %s, среднее ожидание %.4f с, максимум %.4f с, долгих ожиданий %s',
+    pool.checkedout(), pool.size(), max(pool.overflow(), 0), pool_metrics.checkouts,
+    average_wait, pool_metrics.max_wait, pool_metrics.slow_waits
+  )
+
 async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
 
 class Base(DeclarativeBase):
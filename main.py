@@ -1,32 +1,136 @@
 import logging
 import asyncio
+from datetime import datetime
 
 import pytz
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 from config import settings
+from database import log_pool_status
 from app.handlers import router
-from app.scheduler import send_birthday_notifications
+from app.fsm_storage import PostgresStorage
+from app.scheduler import send_birthday_notifications, cleanup_photo_store, sync_installed_photos
+from app.render_pool import render_executor
+from app.prefetch import photo_prefetcher
+from app.roster_sync import roster_listener
+from app.prewarm import calendar_prewarmer
+from app.monitoring import setup_monitoring
 
 bot = Bot(settings.BOT_API_KEY)
-dp = Dispatcher()
+dp = Dispatcher(storage=PostgresStorage() if settings.FSM_STORAGE == 'postgres' else MemoryStorage())
 
 async def main():
     dp.include_router(router)
 
-    scheduler = AsyncIOScheduler(timezone=pytz.timezone('Europe/Moscow'))
-    
+    scheduler = AsyncIOScheduler(
+      timezone=pytz.timezone('Europe/Moscow'),
+      # Задачи живут в памяти каждой реплики: APScheduler 3 не умеет делить одно
+      # хранилище между планировщиками. Общую рассылку каждая реплика проверяет
+      # сама, а отправит её только занявшая запуск в job_runs (claim_daily_run)
+      # Пропущенный запуск выполняется один раз, если опоздание в пределах grace
+      job_defaults={
+        'coalesce': True,
+        'misfire_grace_time': settings.SCHEDULER_MISFIRE_GRACE
+      }
+    )
+
+    # Сама задача решает, в каких поясах пора слать, и догоняет пропущенное
+    # после рестарта, поэтому хранить её расписание в БД не нужно
+    scheduler.add_job(
+      send_birthday_notifications,
+      trigger='cron',
+      minute=f'*/{settings.NOTIFY_CHECK_INTERVAL}',
+      id='birthday_notifications'
+    )
+
     scheduler.add_job(
-      send_birthday_notifications, 
-      trigger='cron', 
-      hour=00, 
-      minute=00, 
+      cleanup_photo_store,
+      trigger='cron',
+      hour=4,
+      minute=00
+    )
+
+    scheduler.add_job(
+      sync_installed_photos,
+      trigger='interval',
+      seconds=settings.PHOTO_SYNC_INTERVAL,
+      next_run_time=datetime.now(pytz.timezone('Europe/Moscow')),
       kwargs={'bot': bot}
     )
+
+    if settings.DB_POOL_LOG_INTERVAL:
+      scheduler.add_job(
+        log_pool_status,
+        trigger='interval',
+        seconds=settings.DB_POOL_LOG_INTERVAL
+      )
     
     scheduler.start()
-    await dp.start_polling(bot)
+
+    photo_prefetcher.start(bot)
+    if settings.ROSTER_NOTIFY:
+        roster_listener.start()
+
+    # Метрики и профилирование — на своём порту, отдельно от вебхука
+    metrics_runner = None
+    if settings.METRICS_ENABLED:
+        metrics_app = web.Application()
+        setup_monitoring(metrics_app)
+        metrics_runner = await start_web_app(metrics_app, settings.METRICS_HOST, settings.METRICS_PORT)
+
+    try:
+        if settings.BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            # Если раньше был включён вебхук, getUpdates вернёт конфликт
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await roster_listener.stop()
+        await calendar_prewarmer.stop()
+        await photo_prefetcher.stop()
+        render_executor.shutdown()
+
+async def start_web_app(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    return runner
+
+async def run_webhook():
+    if not settings.WEBHOOK_BASE_URL or not settings.WEBHOOK_SECRET:
+        raise RuntimeError('Для BOT_MODE=webhook нужны WEBHOOK_BASE_URL и WEBHOOK_SECRET')
+
+    app = web.Application()
+
+    # Апдейты обрабатываются в фоновых задачах, Telegram сразу получает 200;
+    # запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.WEBHOOK_SECRET,
+        handle_in_background=True
+    ).register(app, path=settings.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = await start_web_app(app, settings.WEB_HOST, settings.WEB_PORT)
+
+    await bot.set_webhook(
+        url=settings.WEBHOOK_BASE_URL.rstrip('/') + settings.WEBHOOK_PATH,
+        secret_token=settings.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)